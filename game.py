@@ -3,6 +3,7 @@ import os
 from time import time
 from random import choice, randrange
 from bisect import bisect
+from multiprocessing import freeze_support
 
 d = os.path.dirname(argv[0])
 if d: # else current dir
@@ -85,6 +86,27 @@ file_cache, img_cache, text_cache: caches for loaded image cache (before
 fonts: a fonthandler.Fonts instance, or None if conf.USE_FONTS is False.
 music: filenames for known music.
 screen: the main Pygame surface.
+frame_stats: counters for monitoring performance, a dict with keys:
+    'updates': the number of times backends have been updated.
+    'dropped updates': the number of updates not run because we were too far
+                       behind to catch up (see conf.MAX_UPDATES_PER_FRAME and
+                       conf.MAX_UPDATE_TIME).
+    'draws': the number of frames drawn.
+    'skipped draws': the number of frames not drawn because updating took too
+                     long (see conf.MAX_FRAME_SKIP).
+update_fraction: the fraction of the time between updates that has passed
+                 since the last update, for backends to interpolate with when
+                 drawing.
+update_deadline: the time (as returned by time.time) by which backends should
+                 finish updating for the current frame; backends that do a
+                 variable amount of work per update should stop early after
+                 this.
+last_update: whether the backend update being run is the last before the next
+             draw.
+
+Backends are updated at a fixed rate (conf.UPDATE_FPS for the backend)
+according to the time that has passed, even if drawing can't keep up, and drawn
+at conf.FPS for the backend.
 
 """
 
@@ -99,6 +121,17 @@ screen: the main Pygame surface.
     def __init__ (self, *args, **kwargs):
         self.scheduler = Scheduler()
         self.scheduler.add_timeout(self._update, frames = 1, repeat_frames = 1)
+        self.frame_stats = dict.fromkeys(('updates', 'dropped updates',
+                                          'draws', 'skipped draws'), 0)
+        # time of the last update, time not yet updated for, and the number of
+        # draws skipped in a row
+        self._update_t = None
+        self._update_lag = 0
+        self._update_frame = None
+        self._skipped_draws = 0
+        self.update_fraction = 0
+        self.update_deadline = None
+        self.last_update = True
         # initialise caches
         self.file_cache = {}
         self.img_cache = {}
@@ -129,6 +162,11 @@ screen: the main Pygame surface.
                         for attr, val in self._backend_attrs.iteritems())
             self.backends.append(data)
 
+    def _quit_backend (self, backend):
+        """Let a backend clean up before it's discarded."""
+        if hasattr(backend, 'quit'):
+            backend.quit()
+
     def _restore_backend (self, data):
         """Restore a backend from the given data."""
         self.__dict__.update(data)
@@ -139,9 +177,12 @@ screen: the main Pygame surface.
         self._update_again = True
         self.backend = backend
         backend.dirty = True
+        # don't try to catch up on time spent in another backend
+        self._update_t = None
         i = get_backend_id(backend)
         # set some per-backend things
         self.scheduler.timer.set_fps(conf.FPS[i])
+        self._update_frame = 1. / conf.UPDATE_FPS[i]
         if conf.USE_FONTS:
             fonts = self.fonts
             for k, v in conf.REQUIRED_FONTS[i].iteritems():
@@ -171,7 +212,15 @@ draw(screen) -> drawn: draw anything necessary to screen; drawn is True if the
                        called every frame.
 
 A pause method may optionally be defined, which is called with no arguments
-when the window loses focus to pause the game.
+when the window loses focus to pause the game.  Similarly, a quit method may be
+defined, which is called with no arguments when the backend is quit, or when
+the game quits or restarts while it's running, to clean up anything that
+shouldn't outlive it.
+
+A frame method may also be defined, which is called with no arguments once
+every frame after update, however many updates were due and whether or not the
+frame is drawn, for anything that should keep up with the display rather than
+the simulation, such as following the mouse.
 
 A backend is also given a dirty attribute, which indicates whether its draw
 method should redraw everything (it should set it to False when it does so).
@@ -211,7 +260,7 @@ Returns the started backend.
 
 """
         self._store_backend()
-        return self.switch_backend(*args, **kwargs)
+        return self._replace_backend(*args, **kwargs)
 
     def switch_backend (self, *args, **kwargs):
         """Close the current backend and start a new one.
@@ -219,6 +268,12 @@ Returns the started backend.
 Takes the same arguments as create_backend and returns the created backend.
 
 """
+        if getattr(self, 'backend', None) is not None:
+            self._quit_backend(self.backend)
+        return self._replace_backend(*args, **kwargs)
+
+    def _replace_backend (self, *args, **kwargs):
+        """Create and select a backend, leaving the current one alone."""
         self._init_backend()
         backend = self.create_backend(*args, **kwargs)
         self._select_backend(backend)
@@ -255,6 +310,7 @@ If the running backend is the last (root) one, exit the game.
         if depth < 1:
             return
         if self.backends:
+            self._quit_backend(self.backend)
             self._restore_backend(self.backends.pop())
         else:
             self.quit()
@@ -402,15 +458,58 @@ volume: float to scale volume by.
 
     def _update (self):
         """Update backends and draw."""
+        # work out how many updates are due since last time
+        stats = self.frame_stats
+        frame = self._update_frame
+        t = time()
+        if self._update_t is None:
+            lag = frame
+        else:
+            lag = self._update_lag + t - self._update_t
+        self._update_t = t
+        self.update_deadline = deadline = t + conf.MAX_UPDATE_TIME
+        n = int(lag / frame)
+        max_n = conf.MAX_UPDATES_PER_FRAME
+        if n > max_n:
+            # too far behind to catch up: slow down instead
+            stats['dropped updates'] += n - max_n
+            n = max_n
+            lag = n * frame
+        self._update_lag = lag - n * frame
+        self.update_fraction = self._update_lag / frame
+        # update
         self._update_again = True
         while self._update_again:
             self._update_again = False
             self.backend.event_handler.update()
             # if a new backend was created during the above call, we'll end up
-            # updating twice before drawing
+            # handling input twice before drawing
             if not self._update_again:
-                self._update_again = False
-                self.backend.update()
+                for i in xrange(n):
+                    self.last_update = i == n - 1
+                    self.backend.update()
+                    stats['updates'] += 1
+                    if self._update_again:
+                        # started a new backend: update it once
+                        n = 1
+                        break
+                    if i < n - 1 and time() >= deadline:
+                        # out of time for this frame: drop the rest, and the
+                        # time they were for
+                        stats['dropped updates'] += n - i - 1
+                        self._update_lag = 0
+                        self.update_fraction = 0
+                        break
+        if hasattr(self.backend, 'frame'):
+            self.backend.frame()
+        if time() - t > self.scheduler.timer.frame and \
+           self._skipped_draws < conf.MAX_FRAME_SKIP:
+            # out of time for this frame: don't draw, to help catch up
+            self._skipped_draws += 1
+            stats['skipped draws'] += 1
+            return True
+        self._skipped_draws = 0
+        stats['draws'] += 1
         backend = self.backend
         # fade
         if self.fading:
@@ -495,6 +594,8 @@ volume: float to scale volume by.
     def quit (self, event = None):
         """Quit the game."""
         self.scheduler.timer.stop()
+        for data in self.backends + [{'backend': self.backend}]:
+            self._quit_backend(data['backend'])
 
     def restart (self, *args):
         """Restart the game."""
@@ -719,6 +820,8 @@ Takes the same arguments as Game.colour_fade, without fn and time.
 
 
 if __name__ == '__main__':
+    # for Windows freeze support
+    freeze_support()
     if conf.WINDOW_ICON is not None:
         pg.display.set_icon(pg.image.load(conf.WINDOW_ICON))
     if conf.WINDOW_TITLE is not None:
@@ -1,13 +1,13 @@
-from random import triangular
-
 import pygame as pg
 from pygame import Surface
 
 from conf import conf
-from util import ir, weighted_rand, combine_drawn, blank_sfc
+from util import ir, combine_drawn, blank_sfc
+import sim
 import wmap
 import ui
 
+
 def mk_button (wmap, action):
     def cb (evt, last_up, inside):
         if last_up and inside:
@@ -17,65 +17,22 @@ def mk_button (wmap, action):
     return ui.Button(conf.ACTIONS_LIST_RECT[2], desc, cb)
 
 
-class Action (object):
-    def __init__ (self, wmap, data):
-        self._wmap = wmap
-        self.data = data
-        self.type = data['type']
-        wmap.ask_select_target(self)
+class Action (sim.Action):
+    """An action chosen by the player; sim.Action subclass.
 
-    def _mk_news (self, items):
-        if not isinstance(items, dict):
-            items = dict((n, 1) for n in items)
-        s = weighted_rand(items)
-        if s is None:
-            return None
-        # substitute some values
-        for c, sub in self._news_data.iteritems():
-            s = s.replace('%' + c, sub)
-        return s
+Action(wmap, data)
 
-    def start (self, target):
-        self.target = target
-        data = self.data
-        methods = data['affects']
-        self._news_end = data['news end']
-        # generate news substitution text
-        t = triangular(*data['time'])
-        self._news_data = n_data = {
-            't': '{0} days'.format(ir(t)),
-            'r': '{0}-{1} days'.format(data['time'][0], data['time'][2])
-        }
-        if data['type'] == 'p':
-            p = target.name
-            n_data['p'] = p
-            n_data['P'] = p.capitalize()
-            t_pos = target.pos
-        elif data['type'] == 'c':
-            t_pos = target.centre
-        # and put action into effect
-        else: # data['type'] == 'a'
-            n_data['a'] = target[0]
-            for obj in target[1] + target[2]: # people and connections
-                obj.disable_methods(self, *methods)
-        if data['type'] != 'a':
-            n_data['a'] = self._wmap.area(t_pos)
-            target.disable_methods(self, *methods)
-        # generate initial news
-        news = self._mk_news(data['news start'])
-        return (ir(t * conf.DAY_FRAMES), data['cost'], news)
+wmap: the world map to act on.
+data: the action's definition, from conf.ACTIONS.
 
-    def end (self):
-        # undo action's effects
-        target = self.target
-        t_type = self.data['type']
-        methods = self.data['affects']
-        if t_type in 'pc':
-            target.enable_methods(self, *methods)
-        else: # area
-            for obj in target[1] + target[2]:
-                obj.enable_methods(self, *methods)
-        return self._mk_news(self._news_end)
+Creating an action asks the player to select its target.
+
+"""
+
+    def __init__ (self, wmap, data):
+        sim.Action.__init__(self, wmap.sim, data)
+        self._wmap = wmap
+        wmap.ask_select_target(self)
 
 
 class Selected (ui.Container):
@@ -182,9 +139,9 @@ action: if the player is selecting an area for an action, this is the Action
             head = 'Selected: connection'
             data.append(5)
             data += self._method_map(
-                [(method, data['disabled'], method == current_method,
+                [(method, obj.is_disabled(method), method == current_method,
                   method in affected)
-                 for method, data in obj.methods.iteritems()]
+                 for method in obj.methods]
             )
             data += [
                 5,
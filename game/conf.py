@@ -3,7 +3,6 @@ import os
 from os.path import sep, expanduser, join as join_path
 from collections import defaultdict
 from glob import glob
-from random import gammavariate
 
 import pygame as pg
 
@@ -38,6 +37,7 @@ class Conf (object):
     else:
         CONF_DIR = join_path(os.path.expanduser(u'~'), '.config', IDENT)
     CONF = join_path(CONF_DIR, 'conf')
+    MAP_CACHE_DIR = join_path(CONF_DIR, 'maps')
 
     # data paths
     DATA_DIR = ''
@@ -54,13 +54,28 @@ class Conf (object):
     FULLSCREEN = False
     RESIZABLE = False # also determines whether fullscreen togglable
     RES_W = (1000, 600)
-    RES_F = pg.display.list_modes()[0]
+    try:
+        RES_F = pg.display.list_modes()[0]
+    except (pg.error, TypeError):
+        # no display (list_modes raises or returns -1): only a simulation is
+        # being run, so this isn't needed
+        RES_F = RES_W
     RES = RES_W
     MIN_RES_W = (320, 180)
     ASPECT_RATIO = None
 
     # timing
-    FPS = dd(30) # per-backend
+    FPS = dd(30) # per-backend; how often to draw
+    # per-backend; how often to update, which may be less often than drawing
+    # (the map interpolates between updates)
+    UPDATE_FPS = dd(30)
+    # when behind, updates beyond this many per frame are dropped
+    MAX_UPDATES_PER_FRAME = 5
+    # maximum time to spend on all of a drawn frame's updates, in seconds;
+    # updates still due after this are dropped (see Game.update_deadline)
+    MAX_UPDATE_TIME = .02
+    # when updating takes too long, skip at most this many draws in a row
+    MAX_FRAME_SKIP = 5
 
     # debug
     PROFILE_STATS_FILE = '.profile_stats'
@@ -77,8 +92,18 @@ class Conf (object):
     KEYS_UP = (pg.K_UP, pg.K_w, pg.K_z, pg.K_COMMA)
     KEYS_DOWN = (pg.K_DOWN, pg.K_s, pg.K_o)
     KEYS_DIRN = (KEYS_LEFT, KEYS_UP, KEYS_RIGHT, KEYS_DOWN)
+    # one for each of TIME_SCALES
+    KEYS_TIME_SCALE = ((pg.K_1, pg.K_KP1), (pg.K_2, pg.K_KP2),
+                       (pg.K_3, pg.K_KP3))
+    KEYS_SKIP = (pg.K_TAB,) # skip to the next event
     CLICK_BTNS = (1, 2, 3)
     SCROLL_BTNS = (4, 5)
+    ZOOM_BTNS = (4, 5) # (in, out)
+    ZOOM_STEP = 1.25 # zoom factor per mouse wheel step
+    MAX_ZOOM = 4
+    # distance in pixels the mouse must move with a button held to pan the map
+    # instead of clicking
+    DRAG_THRESHOLD = 4
 
     # audio
     MUSIC_AUTOPLAY = False # just pauses music
@@ -119,10 +144,22 @@ class Conf (object):
     WMAP_RECT = (NEWS_LIST_RECT[2], 0, RES[0] - NEWS_LIST_RECT[2] - actions_w,
                  RES[1])
     # world map
+    # size of the world, which can be larger than the map (it can be zoomed out
+    # to fit)
+    WORLD_SIZE = WMAP_RECT[2:]
     WMAP_BORDER = 15 # contains no people
     # (unselected, selected)
     LINE_COLOUR_GOOD = ((17, 209, 93), (225, 255, 225))
     LINE_COLOUR_BAD = ((196, 94, 99), (255, 200, 200))
+    # zoomed out further than this, people are drawn in clusters
+    LOD_ZOOM = .5
+    CLUSTER_CELL = 24 # size of the area on the screen each cluster covers
+    # (nobody knows, everyone knows); colours are mixed in between
+    CLUSTER_COLOUR = ((17, 209, 93), (196, 94, 99))
+    CLUSTER_HIGHLIGHT_COLOUR = (255, 255, 255)
+    # when more objects than this change appearance at once, the whole map is
+    # redrawn instead of each part that changed
+    MAX_STATIC_REDRAWS = 50
     # ui
     HEAD_HEIGHT = 32
     LIST_GAP = 2
@@ -145,20 +182,43 @@ class Conf (object):
 
     # gameplay
     INITIAL_INFLUENCE = 100
-    INFLUENCE_GROWTH_RATE = .15 # increase per frame
-    DAY_FRAMES = 4 * FPS['level']
+    INFLUENCE_GROWTH_RATE = 18. # increase per day
+    DAY_FRAMES = 4 * UPDATE_FPS['level']
+    # number of simulation frames to run per drawn frame
+    TIME_SCALES = (1, 4, 16)
+    # skipping to the next event gives up after this many days
+    SKIP_MAX_DAYS = 30
     # world map initialisation
+    MAP_SEED = None # None for a random map each time
+    MAP_CACHE = True # whether to cache maps generated with a seed
+    MAP_GEN_PROCESS = True # whether to generate maps in a separate process
     PERSON_NEAREST = 5 # must be > 0
     NUM_PEOPLE = 50
-    CONS_PER_PERSON = lambda: gammavariate(5, .5)
+    # random positions to reject in a row before filling gaps systematically
+    PERSON_PLACE_ATTEMPTS = 30
+    CONS_PER_PERSON = lambda rng: rng.gammavariate(5, .5)
     MAX_CONS_PER_PERSON = 6
     SHORT_CONNECTION_BIAS = 4
-    METHODS_PER_CON = lambda: gammavariate(3, .5)
+    # connections are chosen from this many of the nearest people (None to
+    # consider everyone), plus this many random others for long connections
+    CON_CANDIDATES = 20
+    CON_LONG_CANDIDATES = 5
+    METHODS_PER_CON = lambda rng: rng.gammavariate(3, .5)
     # world map: running
     PERSON_RADIUS = 12 # must be <= PERSON_NEAREST
     CON_RADIUS_SQ = 30 ** 2
+    # 'frame' to update every person and connection every frame, 'events' to
+    # only do anything when messages arrive, or 'numpy' to move all messages
+    # along at once (see sim.BACKENDS)
+    SIM_BACKEND = 'events'
+    SPATIAL_INDEX_CELL = 30 # grid cell size for finding things on the map
+    HOVER_CELL = 4 # mouse movement within cells this size reuses hit tests
     AREAS = ['Area 51']
     NUM_AREAS = min(len(AREAS), 9)
+    AREA_RASTER_CELL = 8 # resolution for looking up areas, in pixels
+    # the area lookup raster is made coarser for large worlds to keep it to at
+    # most this many cells along each side
+    AREA_RASTER_MAX_CELLS = 256
     FACTS = [
         'your favourite game is Superman 64',
         'you\'re actually a vampire',
@@ -1,11 +1,13 @@
 from random import choice
+from time import time
 
 import pygame as pg
 
 from conf import conf
-from util import combine_drawn, sum_pos
+from util import combine_drawn, sum_pos, position_sfc
 import ui
 from wmap import Map
+import mapgen
 import action
 from ext import evthandler as eh
 
@@ -21,13 +23,13 @@ def _setup_widgets (bg, *ws):
             w.text.bg = w.bg
 
 
-def mk_ui (level):
+def mk_ui (level, world):
     bg = level.game.img('bg.png')
     news_r = conf.NEWS_LIST_RECT
     actions_r = conf.ACTIONS_LIST_RECT
     sel = action.Selected(bg)
-    influence = InfluenceWidget(level.influence)
-    wmap = Map(level, conf.WMAP_RECT[2:], sel)
+    influence = InfluenceWidget(conf.INITIAL_INFLUENCE)
+    wmap = Map(level, conf.WMAP_RECT[2:], sel, world)
     sel.wmap = wmap
     news = ui.List(news_r[2:])
     c = ui.Container(
@@ -48,19 +50,35 @@ def mk_ui (level):
 
 
 class InfluenceWidget (ui.Widget):
+    # also shows how fast time is passing
     def __init__ (self, n):
         ui.Widget.__init__(self, conf.INFLUENCE_RECT[2:])
-        self._n = None
-        self.set_val(n)
+        self._shown = None
+        self._n = int(n)
+        self._speed = conf.TIME_SCALES[0]
+        self._set_text()
 
     def set_val (self, n):
-        n = int(n)
-        if n != self._n:
-            text = 'Influence points: {0}'.format(n)
+        self._n = int(n)
+        self._set_text()
+
+    def set_speed (self, speed):
+        # speed is the time scale, or None when skipping to the next event
+        self._speed = speed
+        self._set_text()
+
+    def _set_text (self):
+        shown = (self._n, self._speed)
+        if shown != self._shown:
+            if self._speed is None:
+                speed = 'skipping ahead'
+            else:
+                speed = '{0}x'.format(self._speed)
+            text = 'Influence points: {0}\nSpeed: {1}'.format(self._n, speed)
             self.text = ui.Text(self.size, text, 'normal', 0)
-            if self._n is not None:
+            if self._shown is not None:
                 self.text.bg = self.bg
-            self._n = n
+            self._shown = shown
 
     def draw (self, screen, pos, draw_bg = True):
         rtn = False
@@ -73,35 +91,87 @@ class InfluenceWidget (ui.Widget):
 
 
 class Level (object):
-    def __init__ (self, game, event_handler):
+    def __init__ (self, game, event_handler, seed = None):
         self.game = game
         event_handler.add_event_handlers({
             pg.MOUSEBUTTONDOWN: self._mbdown,
-            pg.MOUSEBUTTONUP: self._mbup
+            pg.MOUSEBUTTONUP: self._mbup,
+            pg.MOUSEMOTION: self._motion
         })
         event_handler.add_key_handlers([
-            (conf.KEYS_BACK, self._cancel, eh.MODE_ONDOWN)
+            (conf.KEYS_BACK, self._cancel, eh.MODE_ONDOWN),
+            (conf.KEYS_SKIP, self._skip, eh.MODE_ONDOWN)
+        ] + [
+            (keys, [(self._set_time_scale, (scale,))], eh.MODE_ONDOWN)
+            for keys, scale in zip(conf.KEYS_TIME_SCALE, conf.TIME_SCALES)
         ])
         for k, v in conf.REQUIRED_FONTS['level'].iteritems():
             game.fonts[k] = v
         action.game = game
         ui.game = game
-        self.init()
+        self.init(seed)
+
+    def init (self, seed = None):
+        """Start the level.
 
-    def init (self):
+init(seed = None)
+
+seed: seed to generate the map with (see mapgen.generate); defaults to
+      conf.MAP_SEED.
+
+"""
+        if seed is None:
+            seed = conf.MAP_SEED
         # reset variables
-        self.influence = conf.INITIAL_INFLUENCE
         self._clicked = {}
+        self._mouse_pos = None
         self.dirty = True
         self.paused = False
+        self.time_scale = conf.TIME_SCALES[0]
+        # frames left to skip looking for an event, or 0 if not skipping
+        self._skip_left = 0
+        # the UI is created once the map is ready
+        self.ui = self.wmap = self.news = self.influence_w = None
+        self._gen = mapgen.Generator(conf.WORLD_SIZE, seed)
+        self._gen_overlays = {}
+        if self._gen.poll():
+            self._start(self._gen.world)
+        else:
+            self.game.fade(self._gen_overlay)
+
+    def quit (self):
+        # don't leave the map generating in the background
+        if self._gen is not None:
+            self._gen.cancel()
+            self._gen = None
+
+    def _gen_overlay (self, t):
+        # fade function showing map generation progress
+        if self.ui is not None:
+            return None
+        percent = int(100 * self._gen.progress)
+        if percent not in self._gen_overlays:
+            sfc = self.game.img('bg.png').copy()
+            text = 'Generating map: {0}%'.format(percent)
+            text = self.game.render_text('subhead', text,
+                                         conf.TEXT_COLOUR)[0]
+            position_sfc(text, sfc)
+            self._gen_overlays = {percent: sfc}
+        return self._gen_overlays[percent]
+
+    def _start (self, world):
         # create UI
-        self.ui, self.wmap, self.news, self.influence_w = mk_ui(self)
+        self._gen = None
+        self.ui, self.wmap, self.news, self.influence_w = mk_ui(self, world)
+        self.dirty = True
         text = '{0} has found out that {1}.  Stop the rumour from spreading!'
         text = text.format(self.wmap.people[0].name.capitalize(),
                            choice(conf.FACTS))
         self.add_news(text)
 
     def _mbdown (self, evt):
+        if self.ui is None:
+            return
         w = self.ui.click(evt.pos, evt)
         if w:
             self._clicked[evt.button] = w
@@ -112,7 +182,28 @@ class Level (object):
             self._clicked[b].click(evt.pos, evt)
             del self._clicked[b]
 
+    def _motion (self, evt):
+        # only store the position: the map checks it once per frame
+        self._mouse_pos = evt.pos
+
+    def _hover (self):
+        pos = self._mouse_pos
+        if pos is not None:
+            x, y, w, h = conf.WMAP_RECT
+            pos = (pos[0] - x, pos[1] - y)
+            if not (0 <= pos[0] < w and 0 <= pos[1] < h):
+                pos = None
+        self.wmap.hover(pos)
+
+    def _set_time_scale (self, key, mode, mods, scale):
+        self.time_scale = scale
+
+    def _skip (self, *args):
+        self._skip_left = conf.SKIP_MAX_DAYS * conf.DAY_FRAMES
+
     def _cancel (self, *args):
+        if self.wmap is None:
+            return
         if self.wmap.selected.showing_type:
             self.wmap.selected.show(None, self.wmap.selecting)
         elif self.wmap.selecting:
@@ -125,22 +216,54 @@ class Level (object):
         for item in items:
             self.news.insert(0, ui.ListItem(w, item))
 
-    def spend (self, cost):
-        self.influence -= cost
-        self.influence_w.set_val(self.influence)
-
     def update (self):
+        if self.ui is None:
+            if self._gen.poll():
+                self._start(self._gen.world)
+            return
+        # interpolation only needs the state from before the last update
+        self.wmap.start_tick(self.game.last_update)
         if self.paused:
             return
-        # update influence
-        wmap = self.wmap
-        self.spend(-conf.INFLUENCE_GROWTH_RATE * \
-                   (1 - float(wmap.n_know) / len(wmap.people)))
-        news = wmap.update()
+        news = self._run()
+        self.influence_w.set_val(self.wmap.sim.influence)
+        self.influence_w.set_speed(None if self._skip_left else
+                                   self.time_scale)
         if news:
             self.add_news(*news)
 
+    def _run (self):
+        # run the map for a frame's worth of time, but stop if this frame's
+        # updates are taking too long; only the final state is drawn
+        wmap = self.wmap
+        deadline = self.game.update_deadline
+        news = []
+        if self._skip_left:
+            # run until something happens, a day at a time
+            events = wmap.sim.n_events
+            while self._skip_left and time() < deadline:
+                frame = wmap.sim.frame
+                news += wmap.update(min(self._skip_left, conf.DAY_FRAMES),
+                                    True)
+                self._skip_left -= wmap.sim.frame - frame
+                if wmap.sim.n_events != events:
+                    self._skip_left = 0
+        else:
+            for i in xrange(self.time_scale):
+                news += wmap.update()
+                if time() >= deadline:
+                    break
+        return news
+
+    def frame (self):
+        # once per frame rather than per update, so dragging the map moves it
+        # as smoothly as it's drawn
+        if self.ui is not None:
+            self._hover()
+
     def draw (self, screen):
+        if self.ui is None:
+            return False
         rtn = False
         draw_bg = True
         if self.dirty:
@@ -0,0 +1,748 @@
+import os
+from os.path import join as join_path
+from math import pi, sin, cos, ceil
+from array import array
+import random
+from hashlib import md5
+from types import FunctionType
+from gzip import GzipFile
+import json
+import signal
+from multiprocessing import Process, Queue
+from Queue import Empty
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from conf import conf
+from util import ir, AliasSampler, FenwickSampler
+from spatial import PointGrid
+
+# generation phases, each with their own random number generator
+GEN_PHASES = ('areas', 'people', 'names', 'cons', 'methods')
+# method identifiers, in the order used for bitmasks in generated maps
+METHODS = sorted(conf.METHODS)
+TITLES = sorted(conf.TITLES)
+# settings that affect generated maps
+GEN_CONF = (
+    'WMAP_BORDER', 'PERSON_RADIUS', 'PERSON_NEAREST', 'NUM_PEOPLE',
+    'PERSON_PLACE_ATTEMPTS', 'CONS_PER_PERSON', 'MAX_CONS_PER_PERSON',
+    'SHORT_CONNECTION_BIAS', 'CON_CANDIDATES', 'CON_LONG_CANDIDATES',
+    'METHODS_PER_CON', 'METHODS', 'AREAS', 'NUM_AREAS', 'FULL_NAMES',
+    'NUM_FULL_NAMES', 'TITLES', 'FORENAMES', 'SURNAMES'
+)
+# increase this when generated maps change for the same settings
+FORMAT_VERSION = 2
+
+
+def place_people (rect, n, nearest, rng = random):
+    """Randomly place people on the map, keeping them apart.
+
+place_people(rect, n, nearest, rng = random) -> positions
+
+rect: (x0, y0, x1, y1) bounds people may be placed within (inclusive).
+n: number of people to place.
+nearest: minimum distance between any two people.
+rng: the random.Random instance (or the random module) to use.
+
+positions: a list of n (x, y) integer positions.
+
+People are placed uniformly at random while there is plenty of room.  Once
+conf.PERSON_PLACE_ATTEMPTS random positions in a row have been rejected, the
+remaining gaps are filled using Bridson's Poisson-disk sampling, spreading out
+from the people already placed.  Raises ValueError if all n people can't fit.
+
+"""
+    x0, y0, x1, y1 = rect
+    grid = PointGrid(nearest)
+    ps = []
+    if n <= 0:
+        return ps
+    # uniform sampling
+    attempts = conf.PERSON_PLACE_ATTEMPTS
+    failed = 0
+    while len(ps) < n and failed < attempts:
+        pos = (rng.randint(x0, x1), rng.randint(y0, y1))
+        if grid.collides(pos, nearest):
+            failed += 1
+        else:
+            grid.add(pos)
+            ps.append(pos)
+            failed = 0
+    # fill the gaps: try positions in an annulus around each active person
+    # until we find one or give up on them
+    active = list(ps)
+    while len(ps) < n and active:
+        i = rng.randrange(len(active))
+        x, y = active[i]
+        for j in xrange(attempts):
+            d = nearest * (1 + rng.random())
+            a = 2 * pi * rng.random()
+            pos = (ir(x + d * cos(a)), ir(y + d * sin(a)))
+            if x0 <= pos[0] <= x1 and y0 <= pos[1] <= y1 and \
+               not grid.collides(pos, nearest):
+                grid.add(pos)
+                ps.append(pos)
+                active.append(pos)
+                break
+        else:
+            # no room around this person
+            active[i] = active[-1]
+            active.pop()
+    if len(ps) < n:
+        raise ValueError('can\'t fit {0} people on the map: only found room '
+                         'for {1}'.format(n, len(ps)))
+    return ps
+
+
+class DistMatrix (object):
+    """Distances between every pair of people.
+
+    CONSTRUCTOR
+
+DistMatrix(positions)
+
+positions: list of (x, y) positions; people are identified by their index in
+           this list.
+
+    METHODS
+
+get
+row
+
+    ATTRIBUTES
+
+n: the number of people.
+
+Distances are stored in a condensed upper-triangular array.  If NumPy is
+available, this is a NumPy array computed one row at a time; otherwise it's an
+array.array.
+
+"""
+
+    def __init__ (self, positions):
+        self.n = n = len(positions)
+        size = n * (n - 1) / 2
+        if numpy is None:
+            ds = array('d')
+            for i, (x1, y1) in enumerate(positions):
+                ds.extend(((x2 - x1) ** 2 + (y2 - y1) ** 2) ** .5
+                          for x2, y2 in positions[i + 1:])
+        else:
+            ds = numpy.empty(size)
+            pos = numpy.array(positions, float).reshape((n, 2))
+            xs = pos[:, 0]
+            ys = pos[:, 1]
+            k = 0
+            for i in xrange(n - 1):
+                dx = xs[i + 1:] - xs[i]
+                dy = ys[i + 1:] - ys[i]
+                end = k + n - i - 1
+                numpy.sqrt(dx * dx + dy * dy, ds[k:end])
+                k = end
+        self._ds = ds
+
+    def _index (self, i, j):
+        # index in the condensed array for i < j
+        return i * self.n - i * (i + 1) / 2 + j - i - 1
+
+    def get (self, i, j):
+        """Get the distance between the people with the given indices."""
+        if i == j:
+            return 0.
+        elif i > j:
+            i, j = j, i
+        return self._ds[i * self.n - i * (i + 1) / 2 + j - i - 1]
+
+    def row (self, i):
+        """Get a list of distances from one person to each person."""
+        n = self.n
+        ds = self._ds
+        if numpy is None:
+            # earlier people are spread through the array
+            rtn = [ds[j * n - j * (j + 1) / 2 + i - j - 1] for j in xrange(i)]
+            rtn.append(0.)
+            start = self._index(i, i + 1)
+            rtn.extend(ds[start:start + n - i - 1])
+            return rtn
+        else:
+            js = numpy.arange(i)
+            before = ds[js * n - js * (js + 1) / 2 + i - js - 1]
+            start = self._index(i, i + 1)
+            after = ds[start:start + n - i - 1]
+            return numpy.concatenate((before, [0.], after)).tolist()
+
+
+class PointDists (object):
+    """Distances between people, computed when needed.
+
+Takes a list of positions like DistMatrix, and has the same get method.  This
+is used when generating a map doesn't need every distance.
+
+"""
+
+    def __init__ (self, positions):
+        self.n = len(positions)
+        self._positions = positions
+
+    def get (self, i, j):
+        """Get the distance between the people with the given indices."""
+        x1, y1 = self._positions[i]
+        x2, y2 = self._positions[j]
+        return ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** .5
+
+
+def con_candidates (i, positions, grid, exclude, k, n_long, rng = random):
+    """Choose people someone might be connected to.
+
+con_candidates(i, positions, grid, exclude, k, n_long, rng = random)
+    -> candidates
+
+i: index of the person to find candidates for.
+positions: list of people's (x, y) positions.
+grid: a PointGrid containing every person's position, with their index as the
+      data.
+exclude: a set of indices of people not to choose (other than i).
+k: number of nearest people to choose.
+n_long: number of other people to choose at random, to allow for some long
+        connections.
+rng: the random.Random instance (or the random module) to use.
+
+candidates: a list of (index, distance, scale) tuples.  scale is the amount to
+            scale the person's weighting by so that the random people stand in
+            for everyone who wasn't chosen.
+
+"""
+    accept = lambda j: j != i and j not in exclude
+    candidates = [(j, d_sq ** .5, 1)
+                  for d_sq, j in grid.nearest(positions[i], k, accept)]
+    # sample the rest uniformly
+    skip = set(exclude)
+    skip.add(i)
+    skip.update(j for j, d, scale in candidates)
+    n = len(positions)
+    n_rest = n - len(skip)
+    if n_rest <= 0 or n_long <= 0:
+        return candidates
+    elif n_rest <= n_long:
+        rest = [j for j in xrange(n) if j not in skip]
+    else:
+        rest = set()
+        while len(rest) < n_long:
+            j = rng.randrange(n)
+            if j not in skip:
+                rest.add(j)
+    scale = float(n_rest) / len(rest)
+    x1, y1 = positions[i]
+    for j in rest:
+        x2, y2 = positions[j]
+        candidates.append((j, ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** .5, scale))
+    return candidates
+
+
+class DisjointSet (object):
+    """Union-find structure tracking which people are connected.
+
+    CONSTRUCTOR
+
+DisjointSet(n)
+
+n: the number of items; items are identified by indices from 0 to n - 1, and
+   each starts in its own set.
+
+    METHODS
+
+find
+union
+components
+
+    ATTRIBUTES
+
+n_components: the current number of sets.
+
+"""
+
+    def __init__ (self, n):
+        self._parent = range(n)
+        self._rank = [0] * n
+        self.n_components = n
+
+    def find (self, i):
+        """Get the representative item of the set containing an item."""
+        parent = self._parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        # compress the path
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union (self, i, j):
+        """Merge the sets containing two items.
+
+Returns whether they were in different sets.
+
+"""
+        i = self.find(i)
+        j = self.find(j)
+        if i == j:
+            return False
+        rank = self._rank
+        if rank[i] < rank[j]:
+            i, j = j, i
+        self._parent[j] = i
+        if rank[i] == rank[j]:
+            rank[i] += 1
+        self.n_components -= 1
+        return True
+
+    def components (self):
+        """Get a list of sets, each a list of items in increasing order."""
+        groups = {}
+        find = self.find
+        for i in xrange(len(self._parent)):
+            groups.setdefault(find(i), []).append(i)
+        return groups.values()
+
+
+def join_components (positions, groups, grid):
+    """Find connections to add to make sure everyone is connected.
+
+join_components(positions, groups, grid) -> edges
+
+positions: list of people's (x, y) positions.
+groups: a DisjointSet giving the people that are already connected; this is
+        updated to contain the new connections.
+grid: a PointGrid containing every person's position, with their index as the
+      data.
+
+edges: a list of (index1, index2) connections to add.
+
+The aim is to add the shortest connections that join everything together.  In
+each round, every person outside the largest group finds the nearest person
+outside their own group, and these candidate connections are added shortest
+first (Kruskal's algorithm), skipping any between people already connected.
+Every round at least halves the number of groups.
+
+"""
+    edges = []
+    find = groups.find
+    while groups.n_components > 1:
+        comps = groups.components()
+        comps.sort(key = len)
+        candidates = []
+        # the largest group's shortest connections are found from the other end
+        for comp in comps[:-1]:
+            root = find(comp[0])
+            accept = lambda j: find(j) != root
+            for i in comp:
+                found = grid.nearest(positions[i], 1, accept)
+                if found:
+                    candidates.append((found[0][0], i, found[0][1]))
+        candidates.sort()
+        for dist_sq, i, j in candidates:
+            if groups.union(i, j):
+                edges.append((i, j))
+    return edges
+
+
+def phase_rngs (seed = None):
+    """Create independent random number generators for each generation phase.
+
+phase_rngs(seed = None) -> rngs
+
+seed: a hashable seed; if None, the generators are seeded from the system.
+
+rngs: {phase: rng} dict of random.Random instances, for each of the phases in
+      GEN_PHASES.
+
+"""
+    rngs = {}
+    for phase in GEN_PHASES:
+        if seed is None:
+            rngs[phase] = random.Random()
+        else:
+            key = md5('{0}/{1}'.format(seed, phase)).hexdigest()
+            rngs[phase] = random.Random(int(key, 16))
+    return rngs
+
+
+def gen_areas (size, rng = random):
+    """Choose area names and lay them out in a grid.
+
+gen_areas(size, rng = random) -> areas
+
+size: (width, height) size of the map.
+rng: the random.Random instance (or the random module) to use.
+
+areas: {name: (x, y)} positions of area centres.
+
+"""
+    w, h = size
+    areas = {}
+    names = rng.sample(conf.AREAS, conf.NUM_AREAS)
+    n_rows = int(ceil(len(names) ** .5))
+    n_per_row = float(len(names)) / n_rows
+    done_f = done = 0
+    dy = ir(h / float(n_rows))
+    y = dy / 2
+    for j in xrange(n_rows):
+        done_f += n_per_row
+        n_this_row = int(done_f) - done
+        dx = ir(w / float(n_this_row))
+        x = dx / 2
+        for i in xrange(n_this_row):
+            areas[names[done + i]] = (x, y)
+            x += dx
+        done += n_this_row
+        y += dy
+    return areas
+
+
+def gen_names (n, rng = random):
+    """Generate names for n people, giving some of the first people full names.
+    """
+    titles = AliasSampler([conf.TITLES[t] for t in TITLES])
+    names = []
+    for i in xrange(n):
+        gender = rng.choice(sorted(conf.FORENAMES))
+        name = TITLES[titles.sample(rng)]
+        if isinstance(name, tuple):
+            name = name[gender == 'female']
+        if name is None:
+            name = ''
+        else:
+            name += ' '
+        fore = rng.choice(conf.FORENAMES[gender])
+        sur = rng.choice(conf.SURNAMES)
+        if isinstance(sur, tuple):
+            sur = sur[gender == 'female']
+        names.append(name + fore + ' ' + sur)
+    n_full = min(conf.NUM_FULL_NAMES, n)
+    names[:n_full] = rng.sample(conf.FULL_NAMES, n_full)
+    return names
+
+
+def gen_cons (positions, rng = random, method_rng = random, progress = None):
+    """Generate connections between people.
+
+gen_cons(positions, rng = random, method_rng = random[, progress]) -> cons
+
+positions: list of people's (x, y) positions.
+rng: the random.Random instance (or the random module) to use to choose who to
+     connect.
+method_rng: the random.Random instance (or the random module) to use to choose
+            the methods each connection can use.
+progress: a function to call with the fraction of the work done every so often.
+
+cons: list of (index1, index2, methods) connections, where methods is a bitmask
+      of the methods in METHODS the connection can use.
+
+"""
+    n = len(positions)
+    nearest = 2 * conf.PERSON_RADIUS + conf.PERSON_NEAREST
+    grid = PointGrid(nearest)
+    for i, pos in enumerate(positions):
+        grid.add(pos, i)
+    k = conf.CON_CANDIDATES
+    if k is None:
+        dists = DistMatrix(positions)
+    method_ws = conf.METHODS
+    methods = AliasSampler([method_ws[m]['freq'] for m in METHODS])
+    n_methods = conf.METHODS_PER_CON
+    n_cons = conf.CONS_PER_PERSON
+    max_cons = conf.MAX_CONS_PER_PERSON
+    bias = conf.SHORT_CONNECTION_BIAS
+    # group by whether connected
+    groups = DisjointSet(n)
+    # {index: set of indices of people they're connected to}
+    connected = dict((i, set()) for i in xrange(n))
+    cons = []
+
+    def add_con (i, j):
+        # choose method types
+        this_methods = 0
+        for x in xrange(ir(max(1, n_methods(method_rng)))):
+            this_methods |= 1 << methods.sample(method_rng)
+        cons.append((i, j, this_methods))
+        connected[i].add(j)
+        connected[j].add(i)
+        groups.union(i, j)
+
+    # give everyone connections biased towards people near them
+    report_every = max(n / 50, 1)
+    for i in xrange(n):
+        if progress is not None and i % report_every == 0:
+            progress(.9 * i / n)
+        exclude = connected[i]
+        # distances have a non-zero minimum
+        if k is None:
+            ws = dict((j, 1. / d ** bias) for j, d in enumerate(dists.row(i))
+                      if j != i and j not in exclude)
+        else:
+            ws = dict((j, scale / d ** bias) for j, d, scale in
+                      con_candidates(i, positions, grid, exclude, k,
+                                     conf.CON_LONG_CANDIDATES, rng))
+        others = FenwickSampler(ws)
+        targets = []
+        this_n_cons = ir(max(1, min(max_cons, min(len(ws), n_cons(rng)))))
+        for x in xrange(this_n_cons - len(exclude)):
+            j = others.sample(rng)
+            targets.append(j)
+            others.remove(j)
+        for j in targets:
+            add_con(i, j)
+    # reduce to one group by adding the shortest joining connections
+    for i, j in join_components(positions, groups, grid):
+        add_con(i, j)
+    return cons
+
+
+def generate (size, seed = None, progress = None):
+    """Generate the contents of a world map.
+
+generate(size, seed = None[, progress]) -> world
+
+size: (width, height) size of the map.
+seed: a hashable seed; the same seed always generates the same map, given the
+      same settings in conf.  If None, the map is random.
+progress: a function to call with the fraction of the work done (from 0 to 1)
+          every so often.
+
+world: a dict with keys:
+    size: as given.
+    seed: as given.
+    areas: {name: (x, y)} positions of area centres.
+    people: a list of each person's (x, y) position.
+    names: a list of each person's name.
+    cons: a list of (index1, index2, methods) connections between people,
+          where methods is a bitmask of the methods in METHODS the connection
+          can use.
+
+The world contains only basic types, so it can be serialised easily.  Each
+generation phase uses its own random number generator (see phase_rngs).
+
+"""
+    if progress is None:
+        progress = lambda done: None
+    rngs = phase_rngs(seed)
+    w, h = size
+    b = conf.WMAP_BORDER
+    nearest = 2 * conf.PERSON_RADIUS + conf.PERSON_NEAREST
+    progress(0)
+    positions = place_people((b, b, w - b, h - b), conf.NUM_PEOPLE, nearest,
+                             rngs['people'])
+    progress(.2)
+    areas = gen_areas(size, rngs['areas'])
+    names = gen_names(len(positions), rngs['names'])
+    progress(.25)
+    cons = gen_cons(positions, rngs['cons'], rngs['methods'],
+                    lambda done: progress(.25 + .75 * done))
+    progress(1)
+    return {
+        'size': tuple(size),
+        'seed': seed,
+        'areas': areas,
+        'people': positions,
+        'names': names,
+        'cons': cons
+    }
+
+
+def _conf_repr (x):
+    """Get a string representing a conf value that doesn't depend on dict
+ordering or the identity of functions."""
+    if isinstance(x, dict):
+        return '{' + ', '.join(sorted(_conf_repr(k) + ': ' + _conf_repr(v)
+                                      for k, v in x.iteritems())) + '}'
+    elif isinstance(x, (list, tuple)):
+        return '(' + ', '.join(_conf_repr(v) for v in x) + ')'
+    elif isinstance(x, FunctionType):
+        code = x.func_code
+        return repr((code.co_code, code.co_consts, code.co_names))
+    else:
+        return repr(x)
+
+
+def conf_hash (size):
+    """Get a hash of the settings that affect generating a map of a given
+size."""
+    data = [FORMAT_VERSION, tuple(size)]
+    data += [_conf_repr(getattr(conf, k)) for k in GEN_CONF]
+    return md5(repr(data)).hexdigest()
+
+
+def cache_file (size, seed):
+    """Get the path of the file a generated map is cached in."""
+    key = md5(repr((seed, conf_hash(size)))).hexdigest()
+    return join_path(conf.MAP_CACHE_DIR, key + '.json.gz')
+
+
+def load (size, seed):
+    """Load a generated map from the cache.
+
+load(size, seed) -> world
+
+size, seed: as taken by generate.
+
+world: the world as returned by generate, or None if it isn't cached.
+
+"""
+    fn = cache_file(size, seed)
+    if not os.path.exists(fn):
+        return None
+    try:
+        with GzipFile(fn) as f:
+            data = json.load(f)
+        return {
+            'size': tuple(data['size']),
+            'seed': seed,
+            'areas': dict((a, tuple(pos))
+                          for a, pos in data['areas'].iteritems()),
+            'people': [tuple(pos) for pos in data['people']],
+            'names': data['names'],
+            'cons': [tuple(c) for c in data['cons']]
+        }
+    except (IOError, ValueError, KeyError, TypeError):
+        print 'warning: invalid cached map: \'{0}\''.format(fn)
+        return None
+
+
+def save (world):
+    """Save a generated map to the cache."""
+    size = world['size']
+    fn = cache_file(size, world['seed'])
+    d = os.path.dirname(fn)
+    try:
+        os.makedirs(d)
+    except OSError, e:
+        if e.errno != 17: # 17 means already exists
+            print 'warning: can\'t create directory: \'{0}\''.format(d)
+            return
+    data = dict(world)
+    del data['seed']
+    try:
+        with GzipFile(fn, 'w') as f:
+            json.dump(data, f, separators = (',', ':'))
+    except IOError:
+        print 'warning: can\'t write to file: \'{0}\''.format(fn)
+
+
+def get (size, seed = None, progress = None):
+    """Load a map from the cache, or generate it.
+
+Takes the same arguments as generate, and returns the same value.  If seed is
+None or conf.MAP_CACHE is False, the cache isn't used.
+
+"""
+    use_cache = seed is not None and conf.MAP_CACHE
+    if use_cache:
+        world = load(size, seed)
+        if world is not None:
+            return world
+    world = generate(size, seed, progress)
+    if use_cache:
+        save(world)
+    return world
+
+
+def _gen_worker (size, seed, queue):
+    """Generate a map in a worker process, for Generator."""
+    # forked from the game, so SDL's handler would turn SIGTERM into a quit
+    # event nothing reads; let Generator.cancel stop us
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        world = get(size, seed, lambda done: queue.put(('progress', done)))
+    except Exception, e:
+        queue.put(('error', '{0}: {1}'.format(type(e).__name__, e)))
+    else:
+        queue.put(('done', world))
+
+
+class Generator (object):
+    """Load or generate a map without blocking.
+
+    CONSTRUCTOR
+
+Generator(size, seed = None)
+
+size, seed: as taken by generate.
+
+If the map isn't cached, it is generated in a separate process when
+conf.MAP_GEN_PROCESS is True, else straight away.
+
+    METHODS
+
+poll
+cancel
+
+    ATTRIBUTES
+
+progress: the fraction of the work done so far, from 0 to 1.
+world: the generated world, as returned by generate, or None if it's not ready.
+
+"""
+
+    def __init__ (self, size, seed = None):
+        self.progress = 0
+        self.world = None
+        self._proc = None
+        if seed is not None and conf.MAP_CACHE:
+            self.world = load(size, seed)
+        if self.world is None and conf.MAP_GEN_PROCESS:
+            self._queue = Queue()
+            proc = Process(target = _gen_worker,
+                           args = (size, seed, self._queue))
+            # don't keep the game running if it quits during generation
+            proc.daemon = True
+            try:
+                proc.start()
+            except OSError:
+                print 'warning: can\'t start a process to generate the map'
+            else:
+                self._proc = proc
+        if self.world is None and self._proc is None:
+            self.world = get(size, seed)
+        if self.world is not None:
+            self.progress = 1
+
+    def poll (self):
+        """Check on the worker process and return whether the map is ready.
+
+Raises ValueError if generation failed.
+
+"""
+        if self.world is not None or self._proc is None:
+            return True
+        # check this first: anything sent before exiting is already queued
+        alive = self._proc.is_alive()
+        while True:
+            try:
+                msg, data = self._queue.get_nowait()
+            except Empty:
+                break
+            if msg == 'progress':
+                self.progress = data
+            elif msg == 'done':
+                self.world = data
+                self.progress = 1
+                self._proc.join()
+                self._proc = None
+                return True
+            else: # msg == 'error'
+                self._proc.join()
+                self._proc = None
+                raise ValueError('map generation failed: ' + data)
+        if not alive:
+            self._proc = None
+            raise ValueError('map generation process died')
+        return False
+
+    def cancel (self):
+        """Stop generating the map."""
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc = None
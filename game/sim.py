@@ -0,0 +1,975 @@
+"""The rumour simulation, independent of anything displayed.
+
+A Sim is built from a world as returned by mapgen.generate, and stepped one
+frame at a time.  The world map's people and connections are subclasses of the
+Person and Connection classes here, which only add drawing and selection.
+
+"""
+
+from heapq import heappush, heappop
+import random
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from conf import conf
+from util import ir, AliasSampler
+import mapgen
+from spatial import NearestRaster, SpatialIndex
+
+# {id(news items): (news items, sampler)}
+_news_samplers = {}
+
+
+def method_speed (method, dist):
+    """Get a method's speed in fraction of total distance per frame."""
+    method = conf.METHODS[method]
+    if method['dist']:
+        return float(method['speed']) / (conf.DAY_FRAMES * dist)
+    else:
+        return 1. / (conf.DAY_FRAMES * method['time'])
+
+
+class Connection (object):
+    """A connection between two people.
+
+    CONSTRUCTOR
+
+Connection(sim, index, people, methods)
+
+sim: the Sim this connection is part of.
+index: this connection's index in sim.cons.
+people: list of people to connect.
+methods: list of methods (identifiers) this connection can use.
+
+    METHODS
+
+other
+is_disabled
+disable_methods
+enable_methods
+effects_changed
+send
+cancel
+arrive
+update
+
+    ATTRIBUTES
+
+sim, index, people: as given.
+dist: length of the connection line, in pixels.
+centre: (x, y) position of the line's centre (ints).
+methods: tuple of available methods, fastest first.
+speeds: tuple of the speeds of the methods in the same order, in fraction of
+        the connection per frame.
+disabled: bitmask of disabled methods, where bit i is set if methods[i] is
+          disabled, whether by actions on this connection or its people, or
+          by area effects (see Sim.add_effect).
+sending: the target person if currently sending a message, else None.
+sent: whether the message has finished sending.
+    [if sending:]
+progress: sending progress, from 0 to 1.
+current_method: the method currently being used to send a message (None if
+                none available).
+speed: the speed of current_method, or 0 if it's None.
+
+"""
+
+    def __init__ (self, sim, index, people, methods):
+        self.sim = sim
+        self.index = index
+        self.people = people
+        self.dist = dist = people[0].dist(people[1]) - 2 * conf.PERSON_RADIUS
+        x1, y1 = people[0].pos
+        x2, y2 = people[1].pos
+        self.centre = (ir(.5 * (x1 + x2)), ir(5 * (y1 + y2)))
+        methods = list(reversed(sorted((method_speed(m, dist), m)
+                                       for m in methods)))
+        self.methods = tuple(m for s, m in methods)
+        self.speeds = tuple(s for s, m in methods)
+        # {method: bit}; since methods are fastest first, the lowest bit not in
+        # disabled is the fastest available method
+        self._bits = dict((m, 1 << i) for i, m in enumerate(self.methods))
+        self._all = (1 << len(methods)) - 1
+        # disabled by actions on this connection or its people
+        self._disabled = 0
+        # the number of those actions disabling each method
+        self._n_disabled = [0] * len(methods)
+        # disabled by area effects, as of Sim.effects_version
+        self._effects_disabled = 0
+        self._effects_version = 0
+        self.sending = False
+        self.sent = False
+
+    def other (self, person = None):
+        """Get the person on the other end."""
+        if person is None:
+            person = self.sending
+        return self.people[self.people[0] is person]
+
+    @property
+    def disabled (self):
+        sim = self.sim
+        if self._effects_version != sim.effects_version:
+            # area effects have changed: see which ones we're in
+            disabled = 0
+            bits = self._bits
+            for action, pos, r, methods in sim.effects_on(self):
+                for m in methods:
+                    disabled |= bits.get(m, 0)
+            self._effects_disabled = disabled
+            self._effects_version = sim.effects_version
+        return self._disabled | self._effects_disabled
+
+    def is_disabled (self, method):
+        """Check whether an available method is disabled."""
+        return bool(self.disabled & self._bits[method])
+
+    def disable_methods (self, action, *methods):
+        """Disable a method.
+
+disable_method(action, *methods)
+
+action: the Action causing this.
+methods: the methods (identifiers) to disable.
+
+Methods stay disabled until every action that disabled them enables them
+again.
+
+"""
+        bits = self._bits
+        n_disabled = self._n_disabled
+        for method in methods:
+            bit = bits.get(method)
+            if bit is not None:
+                i = bit.bit_length() - 1
+                was_disabled = self.disabled & bit
+                n_disabled[i] += 1
+                self._disabled |= bit
+                if not was_disabled and self.sending and \
+                   method == self.current_method:
+                    # was using this method: switch to another
+                    self.send()
+
+    def enable_methods (self, action, *methods):
+        """Enable a method.  (Like disable_method.)"""
+        bits = self._bits
+        n_disabled = self._n_disabled
+        for method in methods:
+            bit = bits.get(method)
+            if bit is not None:
+                i = bit.bit_length() - 1
+                n_disabled[i] -= 1
+                if n_disabled[i] == 0:
+                    self._disabled &= ~bit
+                    if not self.disabled & bit:
+                        self._enabled(i)
+
+    def _enabled (self, i):
+        # methods[i] is now enabled: switch to it if it'd be quicker
+        if self.sending and self.current_method is not None:
+            dist = self.dist
+            t_left = (1 - self.progress) * dist / self.speed
+            if dist / self.speeds[i] < t_left:
+                self.send()
+
+    def effects_changed (self, old_disabled):
+        """Switch methods if area effects have changed which are disabled.
+
+effects_changed(old_disabled)
+
+old_disabled: the disabled attribute from before the change.
+
+"""
+        disabled = self.disabled
+        if self.sending and self.current_method is not None:
+            bit = self._bits[self.current_method]
+            if disabled & bit and not old_disabled & bit:
+                # was using this method: switch to another
+                self.send()
+                return
+        enabled = old_disabled & ~disabled
+        i = 0
+        while enabled:
+            if enabled & 1:
+                self._enabled(i)
+            enabled >>= 1
+            i += 1
+
+    def send (self, sender = None):
+        """Send a message from the given person.
+
+
+Returns whether any methods are available, or None if already sent.
+
+"""
+        resend = sender is None
+        if resend:
+            # re-send in same direction
+            sender = self.sending
+        elif self.sending:
+            # trying to start sending in the other direction: don't
+            return True
+        if not self.sent:
+            self.sending = sender
+            # use fastest available method
+            enabled = self._all & ~self.disabled
+            if enabled:
+                i = (enabled & -enabled).bit_length() - 1
+                self.current_method = self.methods[i]
+                self.speed = self.speeds[i]
+            else:
+                self.current_method = None
+                self.speed = 0
+            self.sim.con_sent(self)
+            if self.current_method is not None:
+                return True
+            # no available methods: if resending, this is an internal call, so
+            # let person know we've stopped sending
+            if resend:
+                sender.disabled(self)
+            return False
+
+    @property
+    def progress (self):
+        return self.sim.con_progress(self)
+
+    def cancel (self):
+        """Cancel sending."""
+        self.sending = False
+        del self.current_method, self.speed
+        self.sim.con_cancelled(self)
+
+    def arrive (self):
+        """Finish sending."""
+        self.sim.n_events += 1
+        self.sending.finished(self)
+        self.other().recieve(self)
+        self.sent = True
+        self.cancel()
+
+    def update (self):
+        if self.sending and self.current_method is not None:
+            self._progress += self.speed
+            if self._progress >= 1:
+                self.arrive()
+
+
+class Person (object):
+    """A person who might find out about the rumour.
+
+    CONSTRUCTOR
+
+Person(sim, index, pos, name)
+
+sim: the Sim this person is part of.
+index: this person's index in sim.people.
+pos: (x, y) position on the map.
+name: the person's name.
+
+    METHODS
+
+dist
+recieve
+send
+disabled
+finished
+disable_methods
+enable_methods
+update
+
+    ATTRIBUTES
+
+sim, index, pos, name: as given.
+cons: list of connections to this person.
+knows: whether this person knows the rumour.
+sending: the Connection being sent along, False if there's nothing to send yet,
+         or None if there's nothing left to send to.
+
+"""
+
+    def __init__ (self, sim, index, pos, name):
+        self.sim = sim
+        self.index = index
+        self.name = name
+        self.pos = pos
+        self.cons = []
+        self.knows = False
+        self._know = []
+        self.sending = False
+
+    def __str__ (self):
+        return str(self.index)
+
+    __repr__ = __str__
+
+    def dist (self, other):
+        """Get the distance to another person."""
+        return self.sim.dists.get(self.index, other.index)
+
+    def recieve (self, con = None):
+        """Recieve the message."""
+        if not self.knows:
+            if con is not None:
+                self._know.append(con.other(self))
+            self.knows = True
+            self.sim.n_know += 1
+            self.sim.person_waiting(self)
+        elif self.sending is con:
+            # recieving from the person we're sending to: cancel sending
+            self.sending = False
+            self.sim.person_waiting(self)
+
+    def send (self):
+        """Send the message."""
+        # find people we're connected to who don't know
+        targets = []
+        know = self._know
+        for c in self.cons:
+            if c.other(self) not in know:
+                targets.append(c)
+        had_any = False
+        if targets:
+            self.sim.rng.shuffle(targets)
+            for c in targets:
+                # try to send
+                success = c.send(self)
+                if success:
+                    self.sending = c
+                    return
+                elif success is False:
+                    had_any = True
+            # no connections remain
+            self.sending = False
+            self.sim.person_waiting(self)
+        if not had_any:
+            # everyone knows: we have nothing to do, ever
+            self.sending = None
+
+    def disabled (self, con):
+        """Tell the person sending cannot continue."""
+        con.cancel()
+        self.send()
+
+    def finished (self, con):
+        """Tell the person sending has finished."""
+        self._know.append(con.other(self))
+        self.sending = False
+        self.sim.person_waiting(self)
+
+    def disable_methods (self, action, *methods):
+        for c in self.cons:
+            c.disable_methods(action, *methods)
+
+    def enable_methods (self, action, *methods):
+        for c in self.cons:
+            c.enable_methods(action, *methods)
+
+    def update (self):
+        if self.knows and self.sending is False:
+            self.send()
+
+
+class Action (object):
+    """An action that disables methods for a while.
+
+    CONSTRUCTOR
+
+Action(sim, data)
+
+sim: the Sim to act on.
+data: the action's definition, from conf.ACTIONS.
+
+    METHODS
+
+start
+end
+
+    ATTRIBUTES
+
+sim, data: as given.
+type: the type of target: 'p' (person), 'c' (connection) or 'a' (area).
+target: the target, once started: a Person, a Connection, or (area, pos) for
+        an area, where area is the name of the area containing the (x, y)
+        position pos at the centre of the affected circle.
+
+"""
+
+    def __init__ (self, sim, data):
+        self.sim = sim
+        self.data = data
+        self.type = data['type']
+
+    def _mk_news (self, items):
+        # news tables come from conf and never change, so reuse samplers
+        key = id(items)
+        if key not in _news_samplers:
+            ws = items
+            if not isinstance(ws, dict):
+                ws = dict((n, 1) for n in ws)
+            _news_samplers[key] = (items, AliasSampler(ws))
+        s = _news_samplers[key][1].sample(self.sim.rng)
+        if s is None:
+            return None
+        # substitute some values
+        for c, sub in self._news_data.iteritems():
+            s = s.replace('%' + c, sub)
+        return s
+
+    def start (self, target):
+        """Put the action into effect.
+
+start(target) -> (time, cost, news)
+
+target: as for the target attribute.
+
+time: the number of frames the action lasts for.
+cost: the influence the action costs.
+news: a news item announcing the action, or None.
+
+"""
+        self.target = target
+        data = self.data
+        methods = data['affects']
+        self._news_end = data['news end']
+        # generate news substitution text
+        t = self.sim.rng.triangular(*data['time'])
+        self._news_data = n_data = {
+            't': '{0} days'.format(ir(t)),
+            'r': '{0}-{1} days'.format(data['time'][0], data['time'][2])
+        }
+        if data['type'] == 'p':
+            p = target.name
+            n_data['p'] = p
+            n_data['P'] = p.capitalize()
+            t_pos = target.pos
+        elif data['type'] == 'c':
+            t_pos = target.centre
+        # and put action into effect
+        else: # data['type'] == 'a'
+            n_data['a'] = target[0]
+            self.sim.add_effect(self, target[1], data['radius'], methods)
+        if data['type'] != 'a':
+            n_data['a'] = self.sim.area(t_pos)
+            target.disable_methods(self, *methods)
+        # generate initial news
+        news = self._mk_news(data['news start'])
+        return (ir(t * conf.DAY_FRAMES), data['cost'], news)
+
+    def end (self):
+        """Undo the action's effects and return a news item, or None."""
+        target = self.target
+        t_type = self.data['type']
+        methods = self.data['affects']
+        if t_type in 'pc':
+            target.enable_methods(self, *methods)
+        else: # area
+            self.sim.remove_effect(self)
+        return self._mk_news(self._news_end)
+
+
+class Sim (object):
+    """The rumour simulation.
+
+    CONSTRUCTOR
+
+Sim(world, rng = random, person = Person, connection = Connection)
+
+world: the world to simulate, as returned by mapgen.generate.
+rng: the random.Random instance (or the random module) to use.
+person: callable to create people with, taking the same arguments as Person.
+        It should return a Person instance.
+connection: callable to create connections with, taking the same arguments as
+            Connection.  It should return a Connection instance.
+
+    METHODS
+
+area
+start_action
+next_action_end
+add_effect
+remove_effect
+effects_on
+step
+run
+markers
+person_waiting
+con_sent
+con_cancelled
+con_progress
+
+    ATTRIBUTES
+
+world, rng: as given.
+size: the (width, height) size of the map.
+areas: {name: (x, y)} positions of areas.
+people: list of Person instances.
+cons: list of Connection instances.
+dists: distances between people, as a mapgen.PointDists.
+spatial: a spatial.SpatialIndex of people and connections, with their indices
+         as data.
+n_know: the number of people who know the rumour.
+influence: the player's influence points.
+frame: the number of frames stepped.
+actions: heap of (end frame, ID, action) for active actions, where the action
+         ends in the step taken when frame is end frame.  IDs are increasing
+         numbers that keep actions ending together in the order they started.
+effects: list of (action, pos, radius, methods) for area effects (see
+         add_effect).
+effects_version: a number that changes whenever effects does.
+n_events: the number of events so far: messages arriving and actions ending.
+
+People and connections tell the Sim when they might have something to send and
+when they start and stop sending, so each frame only updates those that are
+active.
+
+"""
+
+    def __init__ (self, world, rng = random, person = Person,
+                  connection = Connection):
+        self.world = world
+        self.rng = rng
+        self.size = tuple(world['size'])
+        self.areas = world['areas']
+        # built now rather than on the first lookup, which happens in play
+        self._area_raster = NearestRaster(self.areas, self.size,
+                                          conf.AREA_RASTER_CELL,
+                                          conf.AREA_RASTER_MAX_CELLS)
+        positions = world['people']
+        self.people = ps = [person(self, i, pos, name) for i, (pos, name)
+                            in enumerate(zip(positions, world['names']))]
+        self.dists = mapgen.PointDists(positions)
+        self.cons = []
+        for i, j, methods in world['cons']:
+            p1 = ps[i]
+            p2 = ps[j]
+            methods = [m for b, m in enumerate(mapgen.METHODS)
+                       if methods & (1 << b)]
+            c = connection(self, len(self.cons), (p1, p2), methods)
+            self.cons.append(c)
+            p1.cons.append(c)
+            p2.cons.append(c)
+        self.spatial = index = SpatialIndex(conf.SPATIAL_INDEX_CELL)
+        for p in ps:
+            index.add(p.pos, p.index)
+        for c in self.cons:
+            index.add_segment(c.people[0].pos, c.people[1].pos, c.index)
+        self.influence = conf.INITIAL_INFLUENCE
+        self.frame = 0
+        self.actions = []
+        self._action_id = 0
+        self.effects = []
+        self.effects_version = 0
+        # {connection index: effects touching it}
+        self._con_effects = {}
+        self.n_events = 0
+        self._news = []
+        # indices of people who might have something to send
+        self._waiting = set()
+        # indices of connections that are sending
+        self._sending_cons = set()
+        # let someone know
+        self.n_know = 0
+        ps[0].recieve()
+
+    def area (self, pos):
+        """Get area nearest the given position."""
+        return self._area_raster.nearest(pos)
+
+    def start_action (self, action, target):
+        """Start an action and pay for it.
+
+start_action(action, target)
+
+action: the Action to start.
+target: the target, as taken by Action.start.
+
+"""
+        time, cost, news = action.start(target)
+        self._action_id += 1
+        # ends in the time'th step from now (or the next, if time <= 0)
+        end = self.frame + max(time, 1) - 1
+        heappush(self.actions, (end, self._action_id, action))
+        self.influence -= cost
+        if news is not None:
+            self._news.append(news)
+
+    def next_action_end (self):
+        """Get the number of steps until an action ends.
+
+Returns N if an action will end in the Nth call to step from now, or None if
+there are no active actions.
+
+"""
+        if self.actions:
+            return self.actions[0][0] - self.frame + 1
+        else:
+            return None
+
+    def _change_effects (self, effect, add):
+        # add or remove an effect, then let connections that are sending and
+        # might be affected know
+        touching = self.spatial.segments_in(effect[1], effect[2])
+        cons = [c for c in (self.cons[i] for i in touching) if c.sending]
+        old = [c.disabled for c in cons]
+        con_effects = self._con_effects
+        if add:
+            self.effects.append(effect)
+            for i in touching:
+                con_effects.setdefault(i, []).append(effect)
+        else:
+            self.effects.remove(effect)
+            for i in touching:
+                effects = con_effects[i]
+                effects.remove(effect)
+                if not effects:
+                    del con_effects[i]
+        self.effects_version += 1
+        for c, old_disabled in zip(cons, old):
+            c.effects_changed(old_disabled)
+
+    def add_effect (self, action, pos, radius, methods):
+        """Disable methods on every connection touching a circle.
+
+add_effect(action, pos, radius, methods)
+
+action: the Action causing this.
+pos: the (x, y) centre of the circle.
+radius: the circle's radius.
+methods: the methods (identifiers) to disable.
+
+The connections touching the circle are found using the spatial index.  They
+only work out which methods are disabled when they need to know, so this only
+has to deal with those that are currently sending.
+
+"""
+        self._change_effects((action, pos, radius, methods), True)
+
+    def remove_effect (self, action):
+        """Remove the area effect caused by an action."""
+        for effect in self.effects:
+            if effect[0] is action:
+                break
+        else:
+            raise ValueError('no area effect for this action')
+        self._change_effects(effect, False)
+
+    def effects_on (self, con):
+        """Get the area effects touching a connection, as found in effects."""
+        return self._con_effects.get(con.index, ())
+
+    # backend hooks, called by people and connections
+
+    def person_waiting (self, person):
+        """Called when a person might have something to send."""
+        self._waiting.add(person.index)
+
+    def con_sent (self, con):
+        """Called when a connection starts sending (or re-sending)."""
+        con._progress = 0
+        self._sending_cons.add(con.index)
+
+    def con_cancelled (self, con):
+        """Called when a connection stops sending."""
+        del con._progress
+        self._sending_cons.discard(con.index)
+
+    def con_progress (self, con):
+        """Get a connection's sending progress."""
+        return con._progress
+
+    # stepping
+
+    def _step_actions (self):
+        # end any actions that have run out
+        actions = self.actions
+        while actions and actions[0][0] <= self.frame:
+            self.n_events += 1
+            news = heappop(actions)[2].end()
+            if news is not None:
+                self._news.append(news)
+
+    def _step_people (self):
+        # in order, like updating everyone
+        people = self.people
+        waiting = self._waiting
+        for i in sorted(waiting):
+            p = people[i]
+            p.update()
+            if not p.knows or p.sending is not False:
+                waiting.discard(i)
+
+    def _step_cons (self):
+        cons = self.cons
+        for i in sorted(self._sending_cons):
+            cons[i].update()
+
+    def step (self):
+        """Advance the simulation by one frame.
+
+Returns a list of news items generated since the last step.
+
+"""
+        self.influence += conf.INFLUENCE_GROWTH_RATE / conf.DAY_FRAMES * \
+                          (1 - float(self.n_know) / len(self.people))
+        self._step_actions()
+        self._step_people()
+        self._step_cons()
+        self.frame += 1
+        news = self._news
+        self._news = []
+        return news
+
+    def run (self, frames, until_event = False):
+        """Advance the simulation by a number of frames.
+
+run(frames, until_event = False) -> news
+
+frames: the number of frames to step.
+until_event: whether to stop early, after the first frame in which an event
+             happens (see the n_events attribute).
+
+news: a list of news items generated, as for step.
+
+"""
+        news = []
+        events = self.n_events
+        for i in xrange(frames):
+            news += self.step()
+            if until_event and self.n_events != events:
+                break
+        return news
+
+    def _sending (self):
+        # connections that are currently sending
+        return [self.cons[i] for i in self._sending_cons]
+
+    def markers (self, cons = None):
+        """Get the positions of messages being sent.
+
+markers(cons = None) -> positions
+
+cons: a collection of connection indices to only get markers for (those that
+      aren't sending are ignored), or None for every sending connection.
+
+positions: {connection index: (x, y)} positions (floats) along sending
+           connections.
+
+"""
+        if cons is None:
+            sending = self._sending()
+        else:
+            sending = [c for c in (self.cons[i] for i in cons) if c.sending]
+        ms = {}
+        for c in sending:
+            x0, y0 = c.sending.pos
+            x1, y1 = c.other().pos
+            r = c.progress
+            ms[c.index] = (x0 + r * (x1 - x0), y0 + r * (y1 - y0))
+        return ms
+
+
+class EventSim (Sim):
+    """A Sim that schedules message arrivals instead of stepping connections.
+
+Takes the same arguments as Sim.
+
+When a connection starts sending, the frame it will finish on is worked out
+and put in a priority queue, so connections are only dealt with in the frame
+their messages arrive.  run skips straight over frames in which nothing
+happens.
+
+Progress is calculated as speed multiplied by the number of frames sent for,
+rather than added up each frame.  Arrival times match Sim, but very rarely an
+action ending might see slightly different progress and choose a different
+method than it would with Sim.
+
+"""
+
+    def __init__ (self, *args, **kwargs):
+        # (arrival frame, connection index, send ID) for sending connections
+        self._arrivals = []
+        # {connection: (start frame, send ID)}
+        self._sends = {}
+        self._send_id = 0
+        # {speed: frames to send a message}
+        self._durations = {}
+        Sim.__init__(self, *args, **kwargs)
+
+    def con_sent (self, con):
+        self._send_id += 1
+        self._sends[con] = (self.frame, self._send_id)
+        speed = con.speed
+        if speed:
+            # connections are updated after people, so a message sent in this
+            # frame has its first frame of progress in this frame
+            n = self._duration(speed)
+            heappush(self._arrivals,
+                     (self.frame + n - 1, con.index, self._send_id))
+        # else stuck: never arrives
+
+    def _duration (self, speed):
+        # number of frames a message takes to send at a speed; to match Sim,
+        # add up progress the same way, since the rounding errors matter
+        durations = self._durations
+        if speed not in durations:
+            progress = 0
+            n = 0
+            while progress < 1:
+                progress += speed
+                n += 1
+            durations[speed] = n
+        return durations[speed]
+
+    def con_cancelled (self, con):
+        # any queued arrival is ignored once its send ID is gone
+        del self._sends[con]
+
+    def con_progress (self, con):
+        if con not in self._sends:
+            # not sending, like Sim
+            raise AttributeError('progress')
+        return (self.frame - self._sends[con][0]) * con.speed
+
+    def _step_cons (self):
+        arrivals = self._arrivals
+        sends = self._sends
+        cons = self.cons
+        frame = self.frame
+        while arrivals and arrivals[0][0] <= frame:
+            t, i, send_id = heappop(arrivals)
+            c = cons[i]
+            if c in sends and sends[c][1] == send_id:
+                c.arrive()
+
+    def _sending (self):
+        return self._sends.keys()
+
+    def _next_event (self):
+        # the next frame in which anything other than influence changes
+        arrivals = self._arrivals
+        sends = self._sends
+        cons = self.cons
+        # drop cancelled arrivals
+        while arrivals:
+            t, i, send_id = arrivals[0]
+            c = cons[i]
+            if c in sends and sends[c][1] == send_id:
+                break
+            heappop(arrivals)
+        frames = [arrivals[0][0]] if arrivals else []
+        if self.actions:
+            frames.append(self.actions[0][0])
+        return min(frames) if frames else None
+
+    def run (self, frames, until_event = False):
+        news = []
+        end = self.frame + frames
+        events = self.n_events
+        while self.frame < end:
+            if until_event and self.n_events != events:
+                break
+            if self._waiting:
+                news += self.step()
+                continue
+            # nothing can happen until the next event: skip to it
+            t = self._next_event()
+            t = end if t is None else min(t, end)
+            if t > self.frame:
+                days = float(t - self.frame) / conf.DAY_FRAMES
+                self.influence += days * conf.INFLUENCE_GROWTH_RATE * \
+                                  (1 - float(self.n_know) / len(self.people))
+                self.frame = t
+            else:
+                news += self.step()
+        return news
+
+
+class NumpySim (Sim):
+    """A Sim that steps connections using NumPy arrays.
+
+Takes the same arguments as Sim.  Requires NumPy.
+
+The state of each connection's message (sender, recipient, progress and
+current speed) is kept in arrays, and all messages are moved along in one
+operation each frame.  Connections are only dealt with individually when their
+messages arrive.  Results are exactly the same as with Sim.
+
+"""
+
+    def __init__ (self, world, *args, **kwargs):
+        if numpy is None:
+            raise ValueError('NumPy is required for NumpySim')
+        n = len(world['cons'])
+        # person indices, or -1 if not sending
+        self._senders = numpy.empty(n, int)
+        self._senders.fill(-1)
+        self._recipients = numpy.empty(n, int)
+        self._progress = numpy.zeros(n)
+        # 0 if not sending or stuck
+        self._speeds = numpy.zeros(n)
+        Sim.__init__(self, world, *args, **kwargs)
+        self._pos = numpy.array([p.pos for p in self.people], float)
+
+    def con_sent (self, con):
+        i = con.index
+        self._senders[i] = con.sending.index
+        self._recipients[i] = con.other().index
+        self._progress[i] = 0
+        self._speeds[i] = con.speed
+
+    def con_cancelled (self, con):
+        i = con.index
+        self._senders[i] = -1
+        self._progress[i] = 0
+        self._speeds[i] = 0
+
+    def con_progress (self, con):
+        i = con.index
+        if self._senders[i] == -1:
+            # not sending, like Sim
+            raise AttributeError('progress')
+        return float(self._progress[i])
+
+    def _step_cons (self):
+        progress = self._progress
+        progress += self._speeds
+        cons = self.cons
+        for i in numpy.flatnonzero(progress >= 1):
+            cons[i].arrive()
+
+    def _sending (self):
+        cons = self.cons
+        return [cons[i] for i in numpy.flatnonzero(self._senders != -1)]
+
+    def markers (self, cons = None):
+        if cons is None:
+            sending = numpy.flatnonzero(self._senders != -1)
+        else:
+            cons = numpy.fromiter(cons, int, len(cons))
+            sending = cons[self._senders[cons] != -1]
+        start = self._pos[self._senders[sending]]
+        end = self._pos[self._recipients[sending]]
+        r = self._progress[sending][:, numpy.newaxis]
+        return dict(zip(sending.tolist(),
+                        map(tuple, (start + r * (end - start)).tolist())))
+
+
+# conf.SIM_BACKEND values
+BACKENDS = {'frame': Sim, 'events': EventSim, 'numpy': NumpySim}
+
+
+def new (*args, **kwargs):
+    """Create a Sim using the backend set by conf.SIM_BACKEND.
+
+Takes the same arguments as Sim.  If the backend is 'numpy' and NumPy isn't
+available, 'events' is used instead.
+
+"""
+    backend = conf.SIM_BACKEND
+    if backend == 'numpy' and numpy is None:
+        print 'warning: NumPy isn\'t available: using the \'events\' ' \
+              'simulation backend'
+        backend = 'events'
+    return BACKENDS[backend](*args, **kwargs)
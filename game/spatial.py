@@ -0,0 +1,375 @@
+from math import floor, ceil
+from array import array
+
+
+def segment_near (a, b, pos, r):
+    """Check whether a line segment passes within a distance of a point.
+
+segment_near(a, b, pos, r) -> near
+
+a, b: the (x, y) positions of the segment's ends.
+pos: the (x, y) position of the point.
+r: the distance; touching counts as near.
+
+"""
+    x, y = pos
+    (x1, y1), (x2, y2) = a, b
+    dx, dy = (x2 - x1, y2 - y1)
+    l = (dx ** 2 + dy ** 2) ** .5
+    dxu, dyu = (dx / l, dy / l)
+    # get nearest point on line to circle centre
+    to_nearest = (x - x1) * dxu + (y - y1) * dyu
+    if to_nearest <= 0:
+        nx, ny = (x1, y1)
+    elif to_nearest >= l:
+        nx, ny = (x2, y2)
+    else:
+        nx, ny = (to_nearest * dxu + x1, to_nearest * dyu + y1)
+    # check distance to centre
+    return (x - nx) ** 2 + (y - ny) ** 2 <= r ** 2
+
+
+class PointGrid (object):
+    """A uniform grid of points for fast neighbourhood queries.
+
+    CONSTRUCTOR
+
+PointGrid(cell)
+
+cell: the width and height of each grid cell.  Queries are fastest when this is
+      about the size of the radii they use.
+
+    METHODS
+
+add
+collides
+points_in
+nearest
+
+    ATTRIBUTES
+
+cell: as given.
+
+"""
+
+    def __init__ (self, cell):
+        self.cell = float(cell)
+        self._cells = {}
+        # (min x, min y, max x, max y) cell keys used
+        self._bounds = None
+
+    def _key (self, pos):
+        c = self.cell
+        return (int(floor(pos[0] / c)), int(floor(pos[1] / c)))
+
+    def _cell_range (self, pos, r):
+        # keys of the cells that might contain points within r of pos
+        c = self.cell
+        x, y = pos
+        return (xrange(int(floor((x - r) / c)), int(floor((x + r) / c)) + 1),
+                xrange(int(floor((y - r) / c)), int(floor((y + r) / c)) + 1))
+
+    def add (self, pos, data = None):
+        """Add a point.
+
+add(pos, data = None)
+
+pos: the (x, y) position of the point.
+data: anything to store with the point.
+
+"""
+        key = self._key(pos)
+        self._cells.setdefault(key, []).append((pos, data))
+        b = self._bounds
+        if b is None:
+            self._bounds = key + key
+        else:
+            self._bounds = (min(b[0], key[0]), min(b[1], key[1]),
+                            max(b[2], key[0]), max(b[3], key[1]))
+
+    def collides (self, pos, r):
+        """Check whether any point is closer than r to the given position."""
+        x, y = pos
+        r_sq = r * r
+        cells = self._cells
+        ixs, iys = self._cell_range(pos, r)
+        for i in ixs:
+            for j in iys:
+                for (px, py), data in cells.get((i, j), ()):
+                    if (px - x) * (px - x) + (py - y) * (py - y) < r_sq:
+                        return True
+        return False
+
+    def points_in (self, pos, r):
+        """Get the data of the points in a circle, sorted.
+
+points_in(pos, r) -> found
+
+pos: the circle's centre.
+r: the circle's radius; points on the edge are included.
+
+found: list of the data of the points in the circle, sorted.
+
+"""
+        x, y = pos
+        r_sq = r * r
+        cells = self._cells
+        found = []
+        ixs, iys = self._cell_range(pos, r)
+        for i in ixs:
+            for j in iys:
+                for (px, py), data in cells.get((i, j), ()):
+                    if (x - px) ** 2 + (y - py) ** 2 <= r_sq:
+                        found.append(data)
+        found.sort()
+        return found
+
+    def nearest (self, pos, k = 1, accept = None):
+        """Find the points nearest to a position.
+
+nearest(pos, k = 1[, accept]) -> found
+
+pos: (x, y) position to search from.
+k: the maximum number of points to find.
+accept: a function that takes a point's data and returns whether the point
+        should be considered.
+
+found: a list of up to k (distance_squared, data) tuples for the nearest
+       points, nearest first.
+
+Cells are searched in rings outwards from pos, stopping once no unsearched cell
+could contain a nearer point.
+
+"""
+        found = []
+        if self._bounds is None or k < 1:
+            return found
+        x, y = pos
+        cx, cy = self._key(pos)
+        bx0, by0, bx1, by1 = self._bounds
+        max_ring = max(cx - bx0, bx1 - cx, cy - by0, by1 - cy)
+        cells = self._cells
+        c = self.cell
+        ring = 0
+        while ring <= max_ring:
+            if ring == 0:
+                keys = ((cx, cy),)
+            else:
+                x0 = cx - ring
+                x1 = cx + ring
+                keys = [(i, cy - ring) for i in xrange(x0, x1 + 1)]
+                keys += [(i, cy + ring) for i in xrange(x0, x1 + 1)]
+                keys += [(x0, j) for j in xrange(cy - ring + 1, cy + ring)]
+                keys += [(x1, j) for j in xrange(cy - ring + 1, cy + ring)]
+            for key in keys:
+                for (px, py), data in cells.get(key, ()):
+                    if accept is None or accept(data):
+                        dx = px - x
+                        dy = py - y
+                        found.append((dx * dx + dy * dy, data))
+            if len(found) >= k:
+                found.sort()
+                del found[k:]
+                # anything in the next ring is at least this far away
+                r = ring * c
+                if found[-1][0] <= r * r:
+                    break
+            ring += 1
+        found.sort()
+        return found
+
+
+class SpatialIndex (PointGrid):
+    """A uniform grid of points and line segments; PointGrid subclass.
+
+Takes the same arguments as PointGrid.  Points are added using the add method,
+and segments using add_segment.  The data stored with points and segments
+should be sortable, and is usually an index into a list of objects.
+
+    METHODS
+
+add_segment
+segment_at
+segments_in
+
+"""
+
+    def __init__ (self, cell):
+        PointGrid.__init__(self, cell)
+        self._seg_cells = {}
+
+    def add_segment (self, a, b, data = None):
+        """Add a line segment.
+
+add_segment(a, b, data = None)
+
+a, b: the (x, y) positions of the segment's ends.
+data: anything to store with the segment.
+
+"""
+        seg = (a, b, data)
+        cells = self._seg_cells
+        c = self.cell
+        (x1, y1), (x2, y2) = a, b
+        i0 = int(floor(min(x1, x2) / c))
+        i1 = int(floor(max(x1, x2) / c))
+        # store in every cell the segment passes through, column by column
+        for i in xrange(i0, i1 + 1):
+            if x1 == x2:
+                ya, yb = y1, y2
+            else:
+                xa = max(min(x1, x2), i * c)
+                xb = min(max(x1, x2), (i + 1) * c)
+                ya = y1 + (y2 - y1) * (xa - x1) / float(x2 - x1)
+                yb = y1 + (y2 - y1) * (xb - x1) / float(x2 - x1)
+            j0 = int(floor(min(ya, yb) / c))
+            j1 = int(floor(max(ya, yb) / c))
+            for j in xrange(j0, j1 + 1):
+                cells.setdefault((i, j), []).append(seg)
+
+    def _segments_near (self, pos, r):
+        # segments in cells that might be within r of pos, without duplicates
+        cells = self._seg_cells
+        segs = {}
+        ixs, iys = self._cell_range(pos, r)
+        for i in ixs:
+            for j in iys:
+                for seg in cells.get((i, j), ()):
+                    segs[id(seg)] = seg
+        return segs.itervalues()
+
+    def segment_at (self, pos, r):
+        """Get the segment nearest a position.
+
+segment_at(pos, r) -> data
+
+pos: (x, y) position to search from.
+r: maximum distance from pos to the segment.
+
+data: the data of the nearest segment, or None if there are none within r.  If
+      segments are equally near, the one with the smallest data is chosen.
+
+"""
+        px, py = pos
+        r_sq = r * r
+        near = []
+        for (x1, y1), (x2, y2), data in self._segments_near(pos, r):
+            len_sq = (x1 - x2) ** 2 + (y1 - y2) ** 2
+            dx, dy = (x2 - x1, y2 - y1)
+            t = float((px - x1) * dx + (py - y1) * dy) / len_sq
+            if t < 0:
+                # use first end
+                dist_sq = (px - x1) ** 2 + (py - y1) ** 2
+            elif t > 1:
+                # use second end
+                dist_sq = (px - x2) ** 2 + (py - y2) ** 2
+            else:
+                # use line
+                dist_sq = (x1 + dx * t - px) ** 2 + (y1 + dy * t - py) ** 2
+            if dist_sq <= r_sq:
+                near.append((dist_sq, data))
+        return min(near)[1] if near else None
+
+    def segments_in (self, pos, r):
+        """Get the data of the segments touching a circle, sorted.
+
+segments_in(pos, r) -> found
+
+pos: the circle's centre.
+r: the circle's radius.
+
+found: list of the data of the segments that pass within r of pos, sorted.
+
+"""
+        found = [data for a, b, data in self._segments_near(pos, r)
+                 if segment_near(a, b, pos, r)]
+        found.sort()
+        return found
+
+
+class NearestRaster (object):
+    """A low-resolution raster for finding the nearest of a few sites.
+
+    CONSTRUCTOR
+
+NearestRaster(sites, size, cell, max_cells = None)
+
+sites: {label: (x, y)} positions of sites; labels should be sortable.
+size: (width, height) of the region to rasterise, starting at (0, 0).
+cell: the width and height of each raster cell.
+max_cells: if given, cell is increased as necessary to keep the raster to at
+           most this many cells in each direction, so that building it takes
+           bounded time however large the region.
+
+    METHODS
+
+nearest
+
+    ATTRIBUTES
+
+sites, size: as given.
+cell: the cell size used.
+
+Each cell stores its nearest site if that site is strictly nearest to all of
+the cell's corners.  Since the region nearest any one site is convex, this
+means the site is nearest everywhere in the cell.  Other cells (on the
+boundaries between sites), and positions outside the region, fall back to
+checking every site.
+
+"""
+
+    def __init__ (self, sites, size, cell, max_cells = None):
+        self.sites = sites
+        self.size = tuple(size)
+        w, h = size
+        if max_cells is not None:
+            cell = max(cell, float(max(w, h)) / max_cells)
+        self.cell = cell
+        self._sites = sorted((label, pos) for label, pos in sites.iteritems())
+        labels = [label for label, pos in self._sites]
+        self._cols = cols = int(ceil(float(w) / cell))
+        self._rows = rows = int(ceil(float(h) / cell))
+        # nearest site index for each corner, or -1 if there's a tie; distances
+        # are split into parts along each axis so each is only computed once
+        # per row or column
+        dxs = [[(i * cell - x) ** 2 for label, (x, y) in self._sites]
+               for i in xrange(cols + 1)]
+        corners = []
+        for j in xrange(rows + 1):
+            dys = [(j * cell - y) ** 2 for label, (x, y) in self._sites]
+            for dx in dxs:
+                ds = [a + b for a, b in zip(dx, dys)]
+                d = min(ds)
+                corners.append(ds.index(d) if ds.count(d) == 1 else -1)
+        self._raster = raster = array('b')
+        for j in xrange(rows):
+            top = j * (cols + 1)
+            bottom = top + cols + 1
+            for i in xrange(cols):
+                k = corners[top + i]
+                if k == corners[top + i + 1] == corners[bottom + i] == \
+                   corners[bottom + i + 1]:
+                    raster.append(k)
+                else:
+                    raster.append(-1)
+        self._labels = labels
+
+    def _dist_sq (self, a, b):
+        return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2
+
+    def nearest (self, pos):
+        """Get the label of the site nearest a position.
+
+If sites are equally near, the one with the smallest label is chosen.
+
+"""
+        x, y = pos
+        c = self.cell
+        i = int(floor(x / c))
+        j = int(floor(y / c))
+        if 0 <= i < self._cols and 0 <= j < self._rows:
+            k = self._raster[j * self._cols + i]
+            if k != -1:
+                return self._labels[k]
+        return min((self._dist_sq(pos, site_pos), label)
+                   for label, site_pos in self._sites)[1]
@@ -1,6 +1,5 @@
-from random import random, randrange
+import random
 from collections import defaultdict
-from bisect import bisect
 
 import pygame as pg
 
@@ -41,11 +40,169 @@ def sum_pos (*pos):
 
 def randsgn ():
     """Randomly return 1 or -1."""
-    return 2 * randrange(2) - 1
+    return 2 * random.randrange(2) - 1
 
 def rand0 ():
     """Zero-centred random (-1 <= x < 1)."""
-    return 2 * random() - 1
+    return 2 * random.random() - 1
+
+
+def _split_weights (ws):
+    """Split weightings as taken by weighted_rand into keys and weights."""
+    if isinstance(ws, dict):
+        return (list(ws.iterkeys()), list(ws.itervalues()))
+    else:
+        return (range(len(ws)), list(ws))
+
+
+class AliasSampler (object):
+    """Draw weighted random choices from a fixed distribution.
+
+    CONSTRUCTOR
+
+AliasSampler(ws)
+
+ws: weightings, as taken by weighted_rand.
+
+    METHODS
+
+sample
+
+Building the sampler takes time proportional to the number of weightings (using
+Vose's alias method), and each sample then takes constant time.
+
+"""
+
+    def __init__ (self, ws):
+        self._keys, ws = _split_weights(ws)
+        self._n = n = len(ws)
+        if n == 0:
+            raise ValueError('no weightings to sample from')
+        scale = n / float(sum(ws))
+        self._prob = prob = [w * scale for w in ws]
+        self._alias = alias = range(n)
+        small = [i for i, p in enumerate(prob) if p < 1]
+        large = [i for i, p in enumerate(prob) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            alias[s] = l
+            prob[l] += prob[s] - 1
+            (small if prob[l] < 1 else large).append(l)
+        # anything left over is only off by rounding errors
+        for i in small + large:
+            prob[i] = 1
+
+    def sample (self, rng = random):
+        """Return a weighted random choice.
+
+sample(rng = random) -> index
+
+rng: the random.Random instance (or the random module) to use.
+
+index: the chosen index or key, as returned by weighted_rand.
+
+"""
+        x = rng.random() * self._n
+        i = int(x)
+        if x - i >= self._prob[i]:
+            i = self._alias[i]
+        return self._keys[i]
+
+
+class FenwickSampler (object):
+    """Draw weighted random choices from a distribution that can change.
+
+    CONSTRUCTOR
+
+FenwickSampler(ws)
+
+ws: weightings, as taken by weighted_rand.
+
+    METHODS
+
+set
+remove
+sample
+
+    ATTRIBUTES
+
+total: the sum of all current weightings.
+
+Weightings are stored in a Fenwick tree, so changing a weighting and drawing a
+sample each take time logarithmic in the number of weightings.  To sample
+without replacement, remove each choice after drawing it.
+
+"""
+
+    def __init__ (self, ws):
+        self._keys, ws = _split_weights(ws)
+        self._indices = dict((k, i) for i, k in enumerate(self._keys))
+        self._ws = ws
+        self._n = n = len(ws)
+        # 1-based tree, each node holding the sum of a range ending at it
+        self._tree = tree = [0.] + ws
+        for i in xrange(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.total = float(sum(ws))
+        top = 1
+        while top * 2 <= n:
+            top *= 2
+        self._top = top if n else 0
+
+    def set (self, key, w):
+        """Change the weighting of an index or key."""
+        i = self._indices[key]
+        d = w - self._ws[i]
+        self._ws[i] = w
+        self.total += d
+        tree = self._tree
+        n = self._n
+        i += 1
+        while i <= n:
+            tree[i] += d
+            i += i & -i
+
+    def remove (self, key):
+        """Stop an index or key from being chosen (give it zero weight)."""
+        self.set(key, 0)
+
+    def sample (self, rng = random):
+        """Return a weighted random choice.
+
+sample(rng = random) -> index
+
+rng: the random.Random instance (or the random module) to use.
+
+index: the chosen index or key, as returned by weighted_rand.
+
+Raises ValueError if every weighting is zero.
+
+"""
+        if self.total <= 0:
+            raise ValueError('no weightings to sample from')
+        tree = self._tree
+        n = self._n
+        x = rng.random() * self.total
+        i = 0
+        step = self._top
+        while step:
+            j = i + step
+            if j <= n and tree[j] <= x:
+                i = j
+                x -= tree[j]
+            step >>= 1
+        # i is now the index of the chosen weighting, unless rounding errors
+        # have landed us on one that can't be chosen
+        ws = self._ws
+        if i >= n or ws[i] <= 0:
+            candidates = [j for j in xrange(n) if ws[j] > 0]
+            if not candidates:
+                raise ValueError('no weightings to sample from')
+            i = min(candidates, key = lambda j: abs(j - i))
+        return self._keys[i]
 
 
 def weighted_rand (ws):
@@ -58,18 +215,11 @@ ws: weightings, either a list of numbers to weight by or a {key: weighting}
 
 index: the chosen index in the list or key in the dict.
 
+For repeated choices from the same weightings, create an AliasSampler or
+FenwickSampler instead.
+
 """
-    if isinstance(ws, dict):
-        indices, ws = zip(*ws.iteritems())
-    else:
-        indices = range(len(ws))
-    cumulative = []
-    last = 0
-    for w in ws:
-        last += w
-        cumulative.append(last)
-    index = min(bisect(cumulative, cumulative[-1] * random()), len(ws) - 1)
-    return indices[index]
+    return AliasSampler(ws).sample()
 
 
 # graphics
@@ -136,6 +286,26 @@ def combine_drawn (*drawn):
     return rects if rects else False
 
 
+def blit_all (sfc, blit_seq):
+    """Blit a sequence of surfaces to a surface.
+
+blit_all(sfc, blit_seq)
+
+sfc: the surface to blit to.
+blit_seq: sequence of (source, dest) blit arguments.
+
+This uses pygame.Surface.blits where available (Pygame 1.9.4+), which is much
+faster than calling pygame.Surface.blit for each surface.
+
+"""
+    if hasattr(sfc, 'blits'):
+        sfc.blits(blit_seq, False)
+    else:
+        blit = sfc.blit
+        for src, dest in blit_seq:
+            blit(src, dest)
+
+
 def blank_sfc (size):
     """Create a transparent surface with the given (width, height) size."""
     sfc = pg.Surface(size).convert_alpha()
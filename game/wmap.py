@@ -1,153 +1,83 @@
-from math import ceil
-from collections import OrderedDict
-from random import randint, choice, shuffle, sample
+from math import floor, ceil
 
 import pygame as pg
+from pygame import Rect
 
 from conf import conf
-from util import ir, sum_pos, weighted_rand
+from util import ir, sum_pos, blit_all
 from ui import Widget
+import sim
 
 
-def method_speed (method, dist):
-    """Get a method's speed in fraction of total distance per frame."""
-    method = conf.METHODS[method]
-    if method['dist']:
-        return float(method['speed']) / (conf.DAY_FRAMES * dist)
-    else:
-        return 1. / (conf.DAY_FRAMES * method['time'])
+def _drawn_attr (name):
+    # an attribute that affects how an object is drawn, so changing it marks
+    # the object for redrawing on its map's static layer
+    attr = '_' + name
 
+    def get (self):
+        return getattr(self, attr)
 
-class Connection (object):
-    """A connection between two people.
+    def set (self, val):
+        if val != getattr(self, attr, None):
+            setattr(self, attr, val)
+            self.wmap.invalidate(self)
 
-    CONSTRUCTOR
+    return property(get, set)
 
-Connection(people, methods)
 
-people: list of people to connect.
-methods: list of methods (identifiers) this connection can use.
+def _merge_rects (rects):
+    # combine overlapping rects until none overlap
+    merged = []
+    for rect in rects:
+        rect = Rect(rect)
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
 
-    METHODS
 
-other
-send
-cancel
-update
-draw
+def _line_rect (a, b):
+    # rect covering an antialiased line
+    (x1, y1), (x2, y2) = a, b
+    x0 = int(floor(min(x1, x2)))
+    y0 = int(floor(min(y1, y2)))
+    return Rect(x0, y0, int(ceil(max(x1, x2))) - x0 + 1,
+                int(ceil(max(y1, y2))) - y0 + 1).inflate(4, 4)
 
-    ATTRIBUTES
 
-people: as given.
-dist: length of the connection line, in pixels.
-centre: (x, y) position of the line's centre (ints).
-methods: {method: {'disabled': disabled, 'speed': speed}} OrderedDict for each
-         available method, fastest first.  disabled is actually a list, but
-         treat it as a boolean.
-sending: the target person if currently sending a message, else None.
-sent: whether the message has finished sending.
-    [if sending:]
-progress: sending progress, from 0 to 1.
-current_method: the method currently being used to send a message (None if
-                none available).
+class Connection (sim.Connection):
+    """A connection between two people, as shown on the map.
 
-"""
-
-    def __init__ (self, level, people, methods):
-        self.people = people
-        self.dist = dist = people[0].dist(people[1]) - 2 * conf.PERSON_RADIUS
-        x1, y1 = people[0].pos
-        x2, y2 = people[1].pos
-        self.centre = (ir(.5 * (x1 + x2)), ir(5 * (y1 + y2)))
-        methods = reversed(sorted((method_speed(m, dist), m) for m in methods))
-        self.methods = OrderedDict((m, {'disabled': [], 'speed': s})
-                                   for s, m in methods)
-        self.sending = False
-        self.sent = False
-        self.selected = False
-        self._pos_img = level.game.img('connection-progress.png')
-        w, h = self._pos_img.get_size()
-        self._offset = (-w / 2, -h / 2)
+Takes the same arguments as sim.Connection, preceded by the Map instance.
 
-    def other (self, person = None):
-        """Get the person on the other end."""
-        if person is None:
-            person = self.sending
-        return self.people[self.people[0] is person]
+    METHODS
 
-    def disable_methods (self, action, *methods):
-        """Disable a method.
+select
+unselect
+colour
+draw_base
 
-disable_method(action, *methods)
+    ATTRIBUTES
 
-action: the Action causing this.
-methods: the methods (identifiers) to disable.
+wmap: as given.
+selected: whether this connection is selected.
+hovered: whether the mouse is over this connection (or the area it's in).
+rect: a pygame.Rect covering everything draw_base draws, in world coordinates.
 
 """
-        method_data = self.methods
-        for method in methods:
-            if method in method_data:
-                l = method_data[method]['disabled']
-                was_disabled = bool(l)
-                l.append(action)
-                if self.sending and method == self.current_method and \
-                bool(l) != was_disabled:
-                    # was using this method: switch to another
-                    self.send()
-
-    def enable_methods (self, action, *methods):
-        """Enable a method.  (Like disable_method.)"""
-        method_data = self.methods
-        for method in methods:
-            if method in method_data:
-                method = method_data[method]
-                l = method['disabled']
-                was_disabled = bool(l)
-                method['disabled'].remove(action)
-                if self.sending and bool(l) != was_disabled:
-                    dist = self.dist
-                    dist_left = (1 - self.progress) * dist
-                    if self.current_method is not None:
-                        t_left = dist_left / \
-                                 method_data[self.current_method]['speed']
-                        if dist / method['speed'] < t_left:
-                            # switching to this method will be quicker
-                            self.send()
-
-    def send (self, sender = None):
-        """Send a message from the given person.
-
-
-Returns whether any methods are available, or None if already sent.
 
-"""
-        resend = sender is None
-        if resend:
-            # re-send in same direction
-            sender = self.sending
-        elif self.sending:
-            # trying to start sending in the other direction: don't
-            return True
-        if not self.sent:
-            self.sending = sender
-            self.progress = 0
-            # use fastest available method
-            for m, data in self.methods.iteritems():
-                if not data['disabled']:
-                    self.current_method = m
-                    return True
-            # no available methods
-            self.current_method = None
-            # if resending, this is an internal call, so let person know we've
-            # stopped sending
-            if resend:
-                sender.disabled(self)
-            return False
+    sent = _drawn_attr('sent')
+    selected = _drawn_attr('selected')
+    hovered = _drawn_attr('hovered')
 
-    def cancel (self):
-        """Cancel sending."""
-        self.sending = False
-        del self.current_method, self.progress
+    def __init__ (self, wmap, *args):
+        self.wmap = wmap
+        sim.Connection.__init__(self, *args)
+        self.selected = False
+        self.hovered = False
+        self.rect = _line_rect(*(p.pos for p in self.people))
 
     def select (self):
         self.selected = True
@@ -155,131 +85,63 @@ Returns whether any methods are available, or None if already sent.
     def unselect (self):
         self.selected = False
 
-    def update (self):
-        if self.sending and self.current_method is not None:
-            self.progress += self.methods[self.current_method]['speed']
-            if self.progress >= 1:
-                # finished sending
-                self.sending.finished(self)
-                self.other().recieve(self)
-                self.sent = True
-                self.cancel()
+    def colour (self):
+        """Get the colour to draw the line in."""
+        colour = conf.LINE_COLOUR_BAD if self.sent else conf.LINE_COLOUR_GOOD
+        return colour[self.selected or self.hovered]
 
     def draw_base (self, screen, pos = (0, 0)):
-        colour = conf.LINE_COLOUR_BAD if self.sent else conf.LINE_COLOUR_GOOD
         p1 = self.people[0].pos
         p2 = self.people[1].pos
         a = (pos[0] + p1[0], pos[1] + p1[1])
         b = (pos[0] + p2[0], pos[1] + p2[1])
-        pg.draw.aaline(screen, colour[self.selected], a, b)
+        pg.draw.aaline(screen, self.colour(), a, b)
 
-    def draw_pos (self, screen, pos = (0, 0)):
-        if self.sending:
-            x0, y0 = start = self.sending.pos
-            x1, y1 = end = self.other().pos
-            r = self.progress
-            pos = sum_pos(pos,
-                          (ir(x0 + r * (x1 - x0)), ir(y0 + r * (y1 - y0))),
-                          self._offset)
-            screen.blit(self._pos_img, pos)
 
+class Person (sim.Person):
+    """A person, as shown on the map.
 
-class Person (object):
-    def __init__ (self, level, wmap, pos):
-        self.level = level
+Takes the same arguments as sim.Person, preceded by the Map instance.
+
+    METHODS
+
+img
+select
+unselect
+draw
+
+    ATTRIBUTES
+
+wmap: as given.
+selected: whether this person is selected.
+hovered: whether the mouse is over this person (or the area they're in).
+rect: a pygame.Rect covering everything draw might draw, in world
+      coordinates.
+
+"""
+
+    knows = _drawn_attr('knows')
+    selected = _drawn_attr('selected')
+    hovered = _drawn_attr('hovered')
+
+    def __init__ (self, wmap, *args):
         self.wmap = wmap
-        # generate name
-        gender = choice(conf.FORENAMES.keys())
-        name = weighted_rand(conf.TITLES)
-        if isinstance(name, tuple):
-            name = name[gender == 'female']
-        if name is None:
-            name = ''
-        else:
-            name += ' '
-        fore = choice(conf.FORENAMES[gender])
-        sur = choice(conf.SURNAMES)
-        if isinstance(sur, tuple):
-            sur = sur[gender == 'female']
-        name += fore + ' ' + sur
-        self.name = name
-        self.pos = pos
-        self.cons = []
-        self.knows = False
-        self._know = []
-        self.selected = False
-        self.sending = False
-        img = level.game.img
+        img = wmap.level.game.img
         self._imgs = (img('person.png'), img('person-knows.png'),
                       img('person-sel.png'), img('person-knows-sel.png'))
         w, h = self._imgs[0].get_size()
         self._offset = (-w / 2, -h / 2)
-
-    def __str__ (self):
-        return str(self.wmap.people.index(self))
-
-    __repr__ = __str__
-
-    def dist (self, other):
-        """Get the distance to another person."""
-        return self.wmap.dists[frozenset((self, other))]
+        sim.Person.__init__(self, *args)
+        self.selected = False
+        self.hovered = False
+        # all images are drawn at the same offset
+        size = (max(sfc.get_width() for sfc in self._imgs),
+                max(sfc.get_height() for sfc in self._imgs))
+        self.rect = Rect(sum_pos(self.pos, self._offset), size)
 
     def img (self, sel = True):
-        return self._imgs[self.knows + 2 * self.selected * sel]
-
-    def recieve (self, con = None):
-        """Recieve the message."""
-        if not self.knows:
-            if con is not None:
-                self._know.append(con.other(self))
-            self.knows = True
-            self.wmap.n_know += 1
-        elif self.sending is con:
-            # recieving from the person we're sending to: cancel sending
-            self.sending = False
-
-    def send (self):
-        """Send the message."""
-        # find people we're connected to who don't know
-        targets = []
-        know = self._know
-        for c in self.cons:
-            if c.other(self) not in know:
-                targets.append(c)
-        had_any = False
-        if targets:
-            shuffle(targets)
-            for c in targets:
-                # try to send
-                success = c.send(self)
-                if success:
-                    self.sending = c
-                    return
-                elif success is False:
-                    had_any = True
-            # no connections remain
-            self.sending = False
-        if not had_any:
-            # everyone knows: we have nothing to do, ever
-            self.sending = None
-
-    def disabled (self, con):
-        """Tell the person sending cannot continue."""
-        con.cancel()
-        self.send()
-
-    def finished (self, con):
-        """Tell the person sending has finished."""
-        self._know.append(con.other(self))
-        self.sending = False
-
-    def disable_methods (self, action, *methods):
-        for c in self.cons:
-            c.disable_methods(action, *methods)
-
-    def enable_methods (self, action, *methods):
-        for c in self.cons:
-            c.enable_methods(action, *methods)
+        highlight = self.selected or self.hovered
+        return self._imgs[self.knows + 2 * highlight * sel]
 
     def select (self):
         self.selected = True
@@ -287,240 +149,437 @@ class Person (object):
     def unselect (self):
         self.selected = False
 
-    def update (self):
-        if self.knows and self.sending is False:
-            self.send()
-
     def draw (self, screen, pos = (0, 0)):
-        screen.blit(self.img(), sum_pos(pos, self.pos, self._offset))
+        screen.blit(self.img(), sum_pos(pos, self.rect.topleft))
 
 
 class Map (Widget):
-    def __init__ (self, level, size, selected):
+    """The world map widget.
+
+The world is shown through a camera, which can be zoomed using the mouse wheel
+(conf.ZOOM_BTNS) and panned by dragging.  Positions taken and returned by
+methods are in world coordinates, except for hover and click, which take
+positions on the widget (see Map.to_world and Map.to_view).
+
+Lines and people are drawn to a cached static layer, and only the parts of it
+covering objects whose appearance has changed are redrawn (see
+Map.invalidate).  Each frame, the static layer is drawn and everything that
+moves is drawn over it.  Only things that might be in view are drawn, found
+using the spatial index, and when zoomed out beyond conf.LOD_ZOOM, nearby
+people are drawn as a single cluster, with at most one line between each pair
+of clusters.
+
+Sprites are drawn in batches with util.blit_all.  Connections are split into
+chains of lines that share ends when the map is created, and lines are drawn a
+colour at a time, with runs of each chain that are the same colour drawn
+together using pygame.draw.aalines.
+
+    ATTRIBUTES
+
+world_size: the (width, height) size of the world.
+zoom: the camera's scale, in pixels per world unit.
+view_pos: the world position shown at the widget's top-left.
+
+"""
+
+    def __init__ (self, level, size, selected, world):
         Widget.__init__(self, size)
         self.level = level
         self.selected = selected
         self.selecting = None
         self._sel_area = None
-        self._actions = []
-        self._news = []
-        self.areas = areas = {}
-        w, h = self.size
-        # generate areas
-        names = sample(conf.AREAS, conf.NUM_AREAS)
-        n_rows = int(ceil(len(names) ** .5))
-        n_per_row = float(len(names)) / n_rows
-        done_f = done = 0
-        dy = ir(h / float(n_rows))
-        y = dy / 2
-        for j in xrange(n_rows):
-            done_f += n_per_row
-            n_this_row = int(done_f) - done
-            dx = ir(w / float(n_this_row))
-            x = dx / 2
-            for i in xrange(n_this_row):
-                areas[names[done + i]] = (x, y)
-                x += dx
-            done += n_this_row
-            y += dy
-        # generate people
-        self.people = ps = []
-        dists = {}
-        self.dists = used_dists = {}
-        b = conf.WMAP_BORDER
-        x0 = y0 = b
-        x1 = w - b
-        y1 = h - b
-        nearest = 2 * conf.PERSON_RADIUS + conf.PERSON_NEAREST
-        for i in range(conf.NUM_PEOPLE):
-            while True:
-                x, y = randint(x0, x1), randint(y0, y1)
-                this_dists = {}
-                for p in ps:
-                    ox, oy = p.pos
-                    dist = ((ox - x) * (ox - x) + (oy - y) * (oy - y)) ** .5
-                    if dist < nearest:
-                        break
-                    this_dists[p] = dist
+        # objects under the mouse, and what was tested to find them
+        self.hovering = []
+        self._hover_key = None
+        self._hover_pos = None
+        self._hover_area = None
+        self._marker_img = img = level.game.img('connection-progress.png')
+        w, h = img.get_size()
+        self._marker_offset = (-w / 2, -h / 2)
+        # camera
+        self.world_size = tuple(world['size'])
+        self.zoom = self._min_zoom()
+        self.view_pos = (0, 0)
+        self._clamp_view()
+        # (button, widget position, view_pos) when a mouse button was pressed
+        # on the map, and whether it's since moved far enough to be a drag
+        self._press = None
+        self._dragging = False
+        # background, lines and people, with the screen position and camera it
+        # was drawn for, and objects that need to be redrawn on it
+        self._static = None
+        self._static_pos = None
+        self._static_camera = None
+        self._scratch = None
+        self._static_bg = None
+        self._invalid = set()
+        # (camera, clusters, lines), as returned by Map._clusters
+        self._cluster_cache = None
+        # (camera, connection indices), as returned by Map._marker_cons
+        self._marker_cons_cache = None
+        self.sim = sim.new(world, person = lambda *args: Person(self, *args),
+                           connection = lambda *args: Connection(self, *args))
+        self.people = self.sim.people
+        self.cons = self.sim.cons
+        # marker positions before the current tick, to draw between
+        self._prev_markers = {}
+        # {key: (surface, screen position)} for what was last drawn over the
+        # static layer (see Map._dynamic)
+        self._drawn = None
+        # for finding things on the map
+        self.spatial = self.sim.spatial
+        self._mk_chains()
+        # people near enough a point to draw over it, in pixels
+        if self.people:
+            w, h = self.people[0].rect.size
+            self._person_r = (w ** 2 + h ** 2) ** .5
+        else:
+            self._person_r = 0
+
+    def _min_zoom (self):
+        # fully zoomed out, the whole world fits in the widget
+        (w, h), (ww, wh) = self.size, self.world_size
+        return min(1, float(w) / ww, float(h) / wh)
+
+    def _clamp_view (self):
+        # show as much of the world as possible, centring it if it's smaller
+        # than the widget
+        z = self.zoom
+        pos = []
+        for size, world_size, x in zip(self.size, self.world_size,
+                                       self.view_pos):
+            size = float(size) / z
+            if size >= world_size:
+                pos.append(.5 * (world_size - size))
+            else:
+                pos.append(min(max(x, 0), world_size - size))
+        self.view_pos = tuple(pos)
+
+    def to_world (self, pos):
+        """Convert a position on the widget to world coordinates."""
+        z = self.zoom
+        return (self.view_pos[0] + pos[0] / z, self.view_pos[1] + pos[1] / z)
+
+    def to_view (self, pos):
+        """Convert a position in world coordinates to one on the widget."""
+        z = self.zoom
+        return ((pos[0] - self.view_pos[0]) * z,
+                (pos[1] - self.view_pos[1]) * z)
+
+    def zoom_to (self, zoom, about = None):
+        """Change the camera's zoom.
+
+zoom_to(zoom[, about])
+
+zoom: the new value for Map.zoom; this is limited to between the zoom that
+      fits the whole world in the widget and conf.MAX_ZOOM.
+about: the position on the widget to keep still; defaults to its centre.
+
+"""
+        if about is None:
+            about = (.5 * self.size[0], .5 * self.size[1])
+        x, y = self.to_world(about)
+        self.zoom = z = min(max(zoom, self._min_zoom()), conf.MAX_ZOOM)
+        self.view_pos = (x - about[0] / z, y - about[1] / z)
+        self._clamp_view()
+
+    def pan_to (self, pos):
+        """Move the camera to show the given world position at the top-left.
+
+The camera doesn't move further than needed to keep the world in view.
+
+"""
+        self.view_pos = tuple(pos)
+        self._clamp_view()
+
+    def _view_circle (self, rect):
+        # the world position and radius of a circle containing a rect on the
+        # widget
+        return (self.to_world(rect.center),
+                (.5 * (rect.w ** 2 + rect.h ** 2) ** .5 + 1) / self.zoom)
+
+    def _in_view (self, rect):
+        # people and connections that might be drawn in a rect on the widget
+        index = self.spatial
+        pos, r = self._view_circle(rect)
+        z = self.zoom
+        ps = index.points_in(pos, r + self._person_r / z)
+        cs = index.segments_in(pos, r + 2 / z)
+        return ([self.people[i] for i in ps], [self.cons[i] for i in cs])
+
+    def _marker_cons (self):
+        # indices of connections that might have a marker drawn on the widget,
+        # which only change when the camera moves
+        camera = (self.zoom, self.view_pos)
+        if self._marker_cons_cache is not None and \
+           self._marker_cons_cache[0] == camera:
+            return self._marker_cons_cache[1]
+        iw, ih = self._marker_img.get_size()
+        rect = Rect((0, 0), self.size).inflate(2 * iw, 2 * ih)
+        cons = self.spatial.segments_in(*self._view_circle(rect))
+        self._marker_cons_cache = (camera, cons)
+        return cons
+
+    def _person_rect (self, p):
+        # where a person is drawn on the widget
+        x, y = self.to_view(p.pos)
+        return p.rect.move(ir(x) - p.pos[0], ir(y) - p.pos[1])
+
+    def _view_rect (self, obj):
+        # rect covering an object on the widget
+        if isinstance(obj, Person):
+            return self._person_rect(obj)
+        else:
+            return _line_rect(*(self.to_view(p.pos) for p in obj.people))
+
+    def _mk_chains (self):
+        # split connections into chains by walking from each unused
+        # connection along unused connections for as long as possible
+        order = [None] * len(self.cons)
+        # {connection index: (start, end)} in the direction of the chain
+        ends = [None] * len(self.cons)
+        n_chains = 0
+        for c in self.cons:
+            if order[c.index] is not None:
+                continue
+            i = 0
+            p = c.people[0]
+            while c is not None:
+                q = c.other(p)
+                order[c.index] = (n_chains, i)
+                ends[c.index] = (p.pos, q.pos)
+                i += 1
+                p = q
+                c = None
+                for c2 in p.cons:
+                    if order[c2.index] is None and \
+                       (c is None or c2.index < c.index):
+                        c = c2
+            n_chains += 1
+        self._con_order = order
+        self._con_ends = ends
+
+    def _draw_cons (self, sfc, cons):
+        # draw connections a colour at a time, in chain order; the order only
+        # depends on the connections' states, so drawing some of them gives
+        # the same result as drawing them all, where they're drawn
+        order = self._con_order
+        ends = self._con_ends
+        z = self.zoom
+        vx, vy = self.view_pos
+        cons = sorted(((c.selected or c.hovered, c.sent), order[c.index], c)
+                      for c in cons)
+        aalines = pg.draw.aalines
+        last_state = last_chain = last_i = None
+        pts = []
+        for state, (chain, i), c in cons:
+            if state != last_state or chain != last_chain or i != last_i + 1:
+                if pts:
+                    aalines(sfc, colour, False, pts)
+                colour = c.colour()
+                x, y = ends[c.index][0]
+                pts = [((x - vx) * z, (y - vy) * z)]
+            x, y = ends[c.index][1]
+            pts.append(((x - vx) * z, (y - vy) * z))
+            last_state, last_chain, last_i = state, chain, i
+        if pts:
+            aalines(sfc, colour, False, pts)
+
+    def _draw_people (self, sfc, people):
+        rect = self._person_rect
+        blit_all(sfc, [(p.img(), rect(p).topleft) for p in people])
+
+    def _clusters (self):
+        # group people in view by conf.CLUSTER_CELL-sized cells on the widget;
+        # returns [(position, people)] for the cells and [(ends, connections)]
+        # for the connections between each pair of cells, which only change
+        # when the camera moves
+        camera = (self.zoom, self.view_pos)
+        if self._cluster_cache is not None and \
+           self._cluster_cache[0] == camera:
+            return self._cluster_cache[1:]
+        people, cons = self._in_view(Rect((0, 0), self.size))
+        cell = float(conf.CLUSTER_CELL)
+        to_view = self.to_view
+        keys = {}
+        cells = {}
+        for p in people:
+            x, y = to_view(p.pos)
+            keys[p] = k = (int(floor(x / cell)), int(floor(y / cell)))
+            cells.setdefault(k, []).append((x, y, p))
+        centres = {}
+        clusters = []
+        for k, ps in sorted(cells.iteritems()):
+            n = len(ps)
+            centres[k] = pos = (sum(x for x, y, p in ps) / n,
+                                sum(y for x, y, p in ps) / n)
+            clusters.append((pos, [p for x, y, p in ps]))
+        lines = {}
+        for c in cons:
+            ends = []
+            for p in c.people:
+                if p in keys:
+                    ends.append(centres[keys[p]])
                 else:
-                    new_p = Person(level, self, (x, y))
-                    for p, dist in this_dists.iteritems():
-                        dists[frozenset((new_p, p))] = dist
-                    ps.append(new_p)
-                    break
-        # compute all remaining distances
-        for p1 in ps:
-            for p2 in ps:
-                if p1 is not p2:
-                    key = frozenset((p1, p2))
-                    if key not in dists:
-                        x1, y1 = p1.pos
-                        x2, y2 = p2.pos
-                        dists[key] = ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** .5
-
-        def add_con (p1, p2):
-            # need to add dist to self.dists before creating Connection
-            key = frozenset((p1, p2))
-            used_dists[key] = dists[key]
-            # choose method types
-            this_methods = set()
-            for i in xrange(ir(max(1, n_methods()))):
-                this_methods.add(weighted_rand(methods))
-            # create connection and add to stores
-            c = Connection(level, (p1, p2), this_methods)
-            self.cons.append(c)
-            p1.cons.append(c)
-            p2.cons.append(c)
-            g1 = groups[p1]
-            g2 = groups[p2]
-            # merge groups
-            g1.update(g2)
-            for p, g in groups.iteritems():
-                if g is g2:
-                    groups[p] = g1
-
-        # generate connections
-        methods = dict((method, data['freq'])
-                       for method, data in conf.METHODS.iteritems())
-        n_methods = conf.METHODS_PER_CON
-        self.cons = []
-        # and group by whether connected
-        groups = dict((p, set((p,))) for p in ps)
-        n_cons = conf.CONS_PER_PERSON
-        max_cons = conf.MAX_CONS_PER_PERSON
-        # give everyone connections biased towards people near them
-        for p in ps:
-            # distances have a non-zero minimum
-            others = dict((other, 1. / dists[frozenset((p, other))] ** \
-                                       conf.SHORT_CONNECTION_BIAS)
-                          for other in ps if other is not p)
-            for c in p.cons:
-                del others[c.other(p)]
-            targets = []
-            this_n_cons = ir(max(1, min(max_cons, min(len(others), n_cons()))))
-            for i in xrange(this_n_cons - len(p.cons)):
-                other = weighted_rand(others)
-                targets.append(other)
-                del others[other]
-            for other in targets:
-                add_con(p, other)
-        # reduce to one group by adding extra connections
-        frozen_groups = set(frozenset(g) for g in groups.itervalues())
-        while len(frozen_groups) > 1:
-            i = iter(frozen_groups)
-            g1 = next(i)
-            g2 = next(i)
-            dist, p1, p2 = min(min((dists[frozenset((p1, p2))], p1, p2)
-                                   for p2 in g2 if p2 is not p1) for p1 in g1)
-            add_con(p1, p2)
-            frozen_groups = set(frozenset(g) for g in groups.itervalues())
-
-        # give some people full names
-        ps = ps[:min(conf.NUM_FULL_NAMES, len(ps))]
-        for p, name in zip(ps, sample(conf.FULL_NAMES, len(ps))):
-            p.name = name
-        # let someone know
-        self.n_know = 0
-        ps[0].recieve()
+                    # out of view
+                    ends.append(to_view(p.pos))
+            if ends[0] != ends[1]:
+                lines.setdefault(tuple(sorted(ends)), []).append(c)
+        lines = sorted(lines.iteritems())
+        self._cluster_cache = (camera, clusters, lines)
+        return (clusters, lines)
+
+    def _draw_clusters (self, sfc):
+        # draw each cluster as a circle, and one line between each pair of
+        # clusters, showing the most important connection state
+        cell = conf.CLUSTER_CELL
+        clusters, lines = self._clusters()
+        lines = sorted((max((c.selected or c.hovered, c.sent) for c in cs),
+                        i, ends) for i, (ends, cs) in enumerate(lines))
+        # there can be a lot of lines, so don't antialias them
+        line = pg.draw.line
+        colours = (conf.LINE_COLOUR_GOOD, conf.LINE_COLOUR_BAD)
+        for (highlight, sent), i, ends in lines:
+            line(sfc, colours[sent][highlight], *ends)
+        c0, c1 = conf.CLUSTER_COLOUR
+        circle = pg.draw.circle
+        for pos, ps in clusters:
+            n = len(ps)
+            f = float(sum(p.knows for p in ps)) / n
+            colour = [ir(a + f * (b - a)) for a, b in zip(c0, c1)]
+            pos = (ir(pos[0]), ir(pos[1]))
+            r = ir(min(.5 * cell, 2 + n ** .5))
+            circle(sfc, colour, pos, r)
+            if any(p.selected or p.hovered for p in ps):
+                circle(sfc, conf.CLUSTER_HIGHLIGHT_COLOUR, pos, r, 1)
 
     def obj_at (self, pos, types = 'cap'):
         """Get object at a position, as taken by Selected.show."""
-        px, py = pos
+        # hit tests have the same size on the screen at any zoom
+        z = self.zoom
         if 'p' in types:
-            r = conf.PERSON_RADIUS
-            for p in self.people:
-                x, y = p.pos
-                if ((px - x) ** 2 + (py - y) ** 2) ** .5 <= r:
-                    return p
+            found = self.spatial.points_in(pos, conf.PERSON_RADIUS / z)
+            if found:
+                return self.people[found[0]]
         if 'c' in types:
-            r_sq = conf.CON_RADIUS_SQ
-            near = []
-            for c in self.cons:
-                p1, p2 = c.people
-                x1, y1 = p1.pos
-                x2, y2 = p2.pos
-                len_sq = (x1 - x2) ** 2 + (y1 - y2) ** 2
-                dx, dy = (x2 - x1, y2 - y1)
-                t = float((px - x1) * dx + (py - y1) * dy) / len_sq
-                if t < 0:
-                    # use first person
-                    dist_sq = (px - x1) ** 2 + (py - y1) ** 2
-                elif t > 1:
-                    # use second person
-                    dist_sq = (px - x2) ** 2 + (py - y2) ** 2
-                else:
-                    # use line
-                    dist_sq = (x1 + dx * t - px) ** 2 + (y1 + dy * t - py) ** 2
-                # must be near-ish
-                if dist_sq <= r_sq:
-                    near.append((dist_sq, c))
-            if near:
-                # use nearest
-                return min(near)[1]
+            # must be near-ish
+            i = self.spatial.segment_at(pos, conf.CON_RADIUS_SQ ** .5 / z)
+            if i is not None:
+                return self.cons[i]
         if 'a' in types:
             return self.area(pos)
         return None
 
     def objs_in (self, pos, radius):
         """Get the people and connections in a circle on the map."""
-        x, y = pos
-        r_sq = radius ** 2
-        ps = []
-        for p in self.people:
-            px, py = p.pos
-            if (x - px) ** 2 + (y - py) ** 2 <= r_sq:
-                ps.append(p)
-        cs = []
-        for c in self.cons:
-            p1, p2 = c.people
-            x1, y1 = p1.pos
-            x2, y2 = p2.pos
-            dx, dy = (x2 - x1, y2 - y1)
-            l = ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** .5
-            dxu, dyu = (dx / l, dy / l)
-            # get nearest point on line to circle centre
-            to_nearest = (x - x1) * dxu + (y - y1) * dyu
-            if to_nearest <= 0:
-                nx, ny = (x1, y1)
-            elif to_nearest >= l:
-                nx, ny = (x2, y2)
-            else:
-                nx, ny = (to_nearest * dxu + x1, to_nearest * dyu + y1)
-            # check distance to centre
-            if (x - nx) ** 2 + (y - ny) ** 2 <= r_sq:
-                cs.append(c)
-        return (ps, cs)
+        index = self.spatial
+        return ([self.people[i] for i in index.points_in(pos, radius)],
+                [self.cons[i] for i in index.segments_in(pos, radius)])
 
     def area (self, pos):
         """Get area nearest the given position."""
-        x, y = pos
-        dists = []
-        for name, (ax, ay) in self.areas.iteritems():
-            dists.append(((ax - x) ** 2 + (ay - y) ** 2, name))
-        return min(dists)[1]
+        return self.sim.area(pos)
 
     def sel_area (self, pos, r):
-        img = self.level.game.img('area.png')
-        img = pg.transform.smoothscale(img, (r * 2, r * 2))
-        self._sel_area = ((pos[0] - r, pos[1] - r), img.convert_alpha())
+        self._sel_area = (pos, r)
 
     def unsel_area (self):
         self._sel_area = None
 
+    def _drag (self, pos):
+        # pan the camera with the mouse, once it's moved far enough
+        button, start, view_pos = self._press
+        dx = pos[0] - start[0]
+        dy = pos[1] - start[1]
+        if not self._dragging:
+            if dx * dx + dy * dy < conf.DRAG_THRESHOLD ** 2:
+                return
+            self._dragging = True
+        z = self.zoom
+        self.pan_to((view_pos[0] - dx / z, view_pos[1] - dy / z))
+
+    def hover (self, pos):
+        """Highlight whatever is under the mouse.
+
+hover(pos)
+
+pos: the mouse position on the map, or None if it isn't over the map.
+
+If selecting an area for an action, everything in the area is highlighted.
+Hit tests are only redone when the mouse moves into a different
+conf.HOVER_CELL-sized cell, the type of thing being selected changes or the
+camera moves, so this is cheap to call every frame.
+
+If a mouse button is being held down on the map, this also pans the camera.
+
+"""
+        if pos is not None and self._press is not None:
+            self._drag(pos)
+        self._hover_pos = pos
+        action = self.selecting or None
+        if pos is None:
+            key = None
+        else:
+            c = conf.HOVER_CELL
+            key = (action, self.zoom, self.view_pos, pos[0] // c, pos[1] // c)
+        if key == self._hover_key:
+            return
+        self._hover_key = key
+        for obj in self.hovering:
+            obj.hovered = False
+        self.hovering = []
+        self._hover_area = None
+        if key is None:
+            return
+        pos = self.to_world(pos)
+        if action is None or action.type != 'a':
+            obj = self.obj_at(pos, 'pc' if action is None else action.type)
+            if obj is not None:
+                self.hovering = [obj]
+        else:
+            r = action.data['radius']
+            ps, cs = self.objs_in(pos, r)
+            self.hovering = ps + cs
+            text = 'contains {0} people, {1} connections'
+            self._hover_area = (r, text.format(len(ps), len(cs)))
+        for obj in self.hovering:
+            obj.hovered = True
+
     def click (self, pos, evt):
-        if evt.button in conf.CLICK_BTNS:
-            if self.selecting:
-                types = self.selecting.type
-            else:
-                types = 'cap'
-            obj = self.obj_at(pos, types)
-            if types == 'a':
-                # selecting an area for an action: add people and connections
-                # in the area as wanted by Selected
-                ps, cs = self.objs_in(pos, self.selecting.data['radius'])
-                self.selecting.pos = pos
-                obj = (obj, ps, cs)
-            self.selected.show(obj, self.selecting)
+        if evt.type == pg.MOUSEBUTTONDOWN:
+            if evt.button in conf.ZOOM_BTNS:
+                step = conf.ZOOM_STEP
+                if evt.button == conf.ZOOM_BTNS[1]:
+                    step = 1. / step
+                self.zoom_to(self.zoom * step, pos)
+            elif evt.button in conf.CLICK_BTNS and self._press is None:
+                # wait for the release to tell clicks from drags
+                self._press = (evt.button, pos, self.view_pos)
+                self._dragging = False
+                return self
+            return
+        # released (and pos is on the screen, not the map)
+        press = self._press
+        if press is None or evt.button != press[0]:
+            return
+        self._press = None
+        if not self._dragging:
+            self._select(self.to_world(press[1]))
+
+    def _select (self, pos):
+        # select whatever is at a world position
+        if self.selecting:
+            types = self.selecting.type
+        else:
+            types = 'cap'
+        obj = self.obj_at(pos, types)
+        if types == 'a':
+            # selecting an area for an action: add people and connections in
+            # the area as wanted by Selected
+            ps, cs = self.objs_in(pos, self.selecting.data['radius'])
+            self.selecting.pos = pos
+            obj = (obj, ps, cs)
+        self.selected.show(obj, self.selecting)
 
     def cancel_selecting (self):
         self.selecting = None
@@ -532,15 +591,15 @@ class Map (Widget):
     def start_action (self):
         action = self.selecting
         self.selecting = False
-        time, cost, news = action.start(self.selected.showing)
-        self._actions.append([action, time])
-        self.level.spend(cost)
-        if news is not None:
-            self._news.append(news)
+        target = self.selected.showing
+        if action.type == 'a':
+            # the simulation finds what's in the area itself
+            target = (target[0], action.pos)
+        self.sim.start_action(action, target)
 
     def ask_select_target (self, action):
         """Ask the player to select a target for an action."""
-        if action.data['cost'] > self.level.influence:
+        if action.data['cost'] > self.sim.influence:
             # can't afford
             return
         self.selecting = action
@@ -552,33 +611,178 @@ class Map (Widget):
         else:
             sel.show(sel.showing, action)
 
-    def update (self):
-        for a in list(self._actions):
-            # a is (Action, time left)
-            a[1] -= 1
-            if a[1] <= 0:
-                self._actions.remove(a)
-                news = a[0].end()
-                if news is not None:
-                    self._news.append(news)
-        for p in self.people:
-            p.update()
-        for c in self.cons:
-            c.update()
-        self.dirty = True
-        news = self._news
-        self._news = []
-        return news
+    def start_tick (self, interpolate = True):
+        """Start a game tick, which may run any number of updates.
 
-    def draw (self, screen, pos = (0, 0), draw_bg = True):
-        Widget.draw(self, screen, pos, draw_bg)
-        for c in self.cons:
-            c.draw_base(screen, pos)
-        for p in self.people:
-            p.draw(screen, pos)
-        for c in self.cons:
-            c.draw_pos(screen, pos)
+start_tick(interpolate = True)
+
+interpolate: whether to note markers' positions to draw from.  Markers are
+             drawn between their positions at the start of the tick and their
+             current positions, according to Game.update_fraction.  If this is
+             False, markers are drawn at their current positions until the
+             next tick that interpolates.
+
+Only markers that might be in view are noted, as found using the spatial index.
+
+"""
+        if interpolate:
+            self._prev_markers = self.sim.markers(self._marker_cons())
+        else:
+            self._prev_markers = {}
+
+    def update (self, frames = 1, until_event = False):
+        """Advance the simulation; takes the same arguments as Sim.run."""
+        return self.sim.run(frames, until_event)
+
+    def invalidate (self, obj):
+        """Mark a person or connection as needing to be redrawn.
+
+This is called automatically when anything that affects how they're drawn
+changes.
+
+"""
+        if self._static is not None:
+            self._invalid.add(obj)
+
+    def _redraw_static (self, rect):
+        # redraw part of the static layer; antialiased lines come out
+        # differently if they're clipped, so draw everything touching the area
+        # in full on a scratch surface and copy the area back
+        sfc = self._scratch
+        sfc.blit(self._static_bg, rect, rect)
+        ps, cs = self._in_view(rect)
+        self._draw_cons(sfc, cs)
+        self._draw_people(sfc, ps)
+        self._static.blit(sfc, rect, rect)
+
+    def _update_static (self, pos):
+        # bring the static layer up to date; returns True if it was redrawn
+        # from scratch, else a list of the rects that changed
+        camera = (self.zoom, self.view_pos)
+        clusters = self.zoom < conf.LOD_ZOOM
+        invalid = self._invalid
+        rects = None
+        if invalid and not clusters and \
+           len(invalid) <= conf.MAX_STATIC_REDRAWS:
+            # redraw each area covering overlapping objects once
+            rects = _merge_rects(self._view_rect(obj) for obj in invalid)
+            w, h = self.size
+            if sum(rect.w * rect.h for rect in rects) >= .25 * w * h:
+                # might as well redraw everything
+                rects = None
+        if self._static is None or pos != self._static_pos or \
+           camera != self._static_camera or (invalid and rects is None):
+            # clusters are only ever redrawn in full
+            if self._static is None:
+                self._static = pg.Surface(self.size).convert()
+                self._scratch = pg.Surface(self.size).convert()
+                self._static_bg = pg.Surface(self.size).convert()
+            if pos != self._static_pos:
+                # the background might not be opaque, so keep an opaque copy
+                # of the part behind the map
+                self._static_bg.fill((0, 0, 0))
+                self._static_bg.blit(self.bg, (0, 0), (pos, self.size))
+            static = self._static
+            self._static_pos = pos
+            self._static_camera = camera
+            static.blit(self._static_bg, (0, 0))
+            if clusters:
+                self._draw_clusters(static)
+            else:
+                ps, cs = self._in_view(static.get_rect())
+                self._draw_cons(static, cs)
+                self._draw_people(static, ps)
+            changed = True
+        else:
+            changed = rects or []
+            for rect in changed:
+                self._redraw_static(rect)
+        invalid.clear()
+        return changed
+
+    def _dynamic (self, pos):
+        # get a list of (key, surface, screen position) for everything drawn
+        # over the static layer, in drawing order
+        items = []
+        game = self.level.game
+        z = self.zoom
+        # messages being sent, interpolated from the start of the tick, if
+        # they're in view
+        img = self._marker_img
+        iw, ih = img.get_size()
+        w, h = self.size
+        ox, oy = sum_pos(pos, self._marker_offset)
+        r = game.update_fraction
+        prev = self._prev_markers
+        to_view = self.to_view
+        for i, (x, y) in self.sim.markers(self._marker_cons()).iteritems():
+            if i in prev:
+                x0, y0 = prev[i]
+                x = x0 + r * (x - x0)
+                y = y0 + r * (y - y0)
+            x, y = to_view((x, y))
+            if -iw < x < w + iw and -ih < y < h + ih:
+                items.append((i, img, (ox + ir(x), oy + ir(y))))
         if self._sel_area is not None:
-            img_pos, img = self._sel_area
-            screen.blit(img, sum_pos(pos, img_pos))
-        return True
+            centre, r = self._sel_area
+            x, y = sum_pos(pos, [ir(x) for x in to_view(centre)])
+            r = max(ir(r * z), 1)
+            img = game.img('area.png', (r * 2, r * 2))
+            items.append(('sel area', img, (x - r, y - r)))
+        if self._hover_area is not None:
+            # preview the area an action would cover
+            r, text = self._hover_area
+            x, y = sum_pos(pos, self._hover_pos)
+            r = max(ir(r * z), 1)
+            img = game.img('area.png', (r * 2, r * 2))
+            items.append(('hover area', img, (x - r, y - r)))
+            text = game.render_text('normal', text, conf.TEXT_COLOUR,
+                                    cache = ('hover area', text))[0]
+            w, h = text.get_size()
+            items.append(('hover text', text, (x - w / 2, y - r - h)))
+        return items
+
+    def draw (self, screen, pos = (0, 0), draw_bg = True):
+        """Draw the map.
+
+Only the parts of the screen that changed are drawn, unless the widget is
+dirty; markers that moved less than a pixel don't count as changed.  Nothing
+is drawn outside the widget.
+
+"""
+        self.pos = pos
+        static_changed = self._update_static(pos)
+        items = self._dynamic(pos)
+        drawn = dict((key, (sfc, p)) for key, sfc, p in items)
+        last_drawn = self._drawn
+        self._drawn = drawn
+        map_rect = Rect(pos, self.size)
+        clip = screen.get_clip()
+        if self.dirty or static_changed is True or last_drawn is None:
+            # draw everything
+            self.dirty = False
+            screen.set_clip(map_rect)
+            screen.blit(self._static, pos)
+            blit_all(screen, [(sfc, p) for key, sfc, p in items])
+            screen.set_clip(clip)
+            return True
+        # rects covering things that changed, in their old and new places
+        rects = [rect.move(pos) for rect in static_changed]
+        for old, new in ((last_drawn, drawn), (drawn, last_drawn)):
+            for key, (sfc, p) in old.iteritems():
+                if new.get(key) != (sfc, p):
+                    rects.append(Rect(p, sfc.get_size()))
+        rects = [rect.clip(map_rect) for rect in rects]
+        rects = [rect for rect in rects if rect.w and rect.h]
+        if not rects:
+            return False
+        # restore the static layer there and redraw whatever overlaps
+        item_rects = [Rect(p, sfc.get_size()) for key, sfc, p in items]
+        static = self._static
+        for rect in rects:
+            screen.set_clip(rect)
+            screen.blit(static, rect, rect.move(-pos[0], -pos[1]))
+            blit_all(screen, [items[i][1:]
+                              for i in rect.collidelistall(item_rects)])
+        screen.set_clip(clip)
+        return rects